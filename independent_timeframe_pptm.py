@@ -19,6 +19,27 @@
         r = comm.gather(lst, root=0)
         # do something to r
     launch(postprocess, kwdict, afunc=aggr)
+
+    # when the cost of the time frames varies a lot (e.g. late frames of a moving window run are much more expensive),
+    # let rank 0 hand out the time frames on demand instead of splitting them into fixed blocks:
+    launch(postprocess, kwdict, schedule='dynamic')
+
+    # without MPI (mpi4py missing or IGNORE_MPI4PY_IMPORT set) the time frames can be processed by a pool of processes,
+    # save() works in the workers and afunc gets the results in time order, mpi_gather etc. work as with one rank
+    launch(postprocess, kwdict, workers=64)
+
+    # each rank reads the files of the next time frames in a background thread while func works on the current one
+    # (readahead time frames, at most readahead_bytes of data) and save() hands the data to a background writer
+    launch(postprocess, kwdict, readahead=4, readahead_bytes=8 * 1024**3)
+
+    # a time step that fails (e.g. a corrupt file) is retried twice then skipped instead of aborting the whole job, and
+    # a rerun with resume=True only processes the time steps that are not finished yet
+    launch(postprocess, kwdict, retries=2, resume=True)
+
+    # reduce the results on the fly instead of collecting all of them (see the reducer classes)
+    mv = MeanVarReducer()
+    launch(postprocess, kwdict, reducers=[mv])
+    mean, var = mv.result  # on rank 0
 """
 
 __author__ = "Han Wen"
@@ -31,11 +52,21 @@ __email__ = "hanwen@ucla.edu"
 __status__ = "Development"
 
 import os
+import copy
 import glob
+import json
+import time
 import numpy as np
 import traceback
+import threading
+import queue
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from itertools import chain
 from osh5io import read_h5, write_h5
+from osh5def import H5Data
 try:
     # importing mpi4py cause hard crash on some login nodes, use the following flag to disable mpi4py
     if not os.environ.get('IGNORE_MPI4PY_IMPORT'):
@@ -48,18 +79,35 @@ try:
 except ImportError:
     comm, rank, size = None, 0, 1
 total_time = 0
+my_timesteps = []  # the time steps (file indices) this rank has processed, in the same order as the results
+_saved = []  # dataset names saved by the time step being processed
+_reducers, _keep_results = [], True
+# message tags of the dynamic scheduler
+_TAG_REQUEST, _TAG_WORK, _TAG_STOP = 1, 2, 3
 
 
 def save(sd, dataset_name):
+    _saved.append(dataset_name)
     return save_funchook(sd, dataset_name)
 
 
+def _save_h5(outdir, sd, dataset_name):
+    odir = _outdir(outdir)
+    odir += '/' + dataset_name + '/'
+    # can't add barrier here due to uneven work load, any rank (or worker process) may be the first one to save
+    if not os.path.exists(odir):  # prepare output dir
+        os.makedirs(odir, exist_ok=True)
+    # print('rank ' + str(rank) + 'writng to '+ odir)
+    write_h5(sd, path=odir, dataset_name=dataset_name)
+
+
 # define a few commonly used MPI calls for collecting final results
 # we separate the collecting method from filler function to final container. user can freely combine the two
+# without MPI they behave as if there is only one rank
 def mpi_gather(towhat):
     def collector(sublist):
         if not comm:
-            return sublist
+            return towhat([sublist])
         lst = comm.gather(sublist, root=0)
         if rank == 0:
             return towhat(lst)
@@ -69,7 +117,7 @@ def mpi_gather(towhat):
 def mpi_allgather(towhat):
     def collector(sublist):
         if not comm:
-            return sublist
+            return towhat([sublist])
         lst = comm.allgather(sublist)
         return towhat(lst)
     return collector
@@ -97,29 +145,384 @@ def gather_to_zipped_tuple_of_lists_group_by_quantity(lst):  # e.g. [ [(,), (,)]
 
 
 def sum2var(sublist):
-    subtotal, total = 0, 0
+    """sum of the values (numbers or arrays) of all ranks, on rank 0 (None on the other ranks)"""
+    r = SumReducer()
     for v in sublist:
-        subtotal += v
-    comm.Reduce(subtotal, total, op=MPI.SUM, root=0)
-    return total
+        r.add(v)
+    return r.reduce()
 
 
-def launch(func, kw4func, outdir=None, afunc=None):
-    """wrap MPI calls & for loops around user defined postprocessing function"""
-    # define the save function and make it global. we need to define it here to get the outdir info from launch()
-    global save_funchook
+# streaming reducers: every result is folded into a running accumulator as soon as func returns, so the memory does not
+# grow with the number of time steps. the accumulators of all ranks are combined by buffer based MPI reductions on the
+# raw arrays, the meta data of H5Data results is sent once. pass them to launch, e.g.
+#     mv = MeanVarReducer(select=lambda res: res[0])     # if func returns a tuple
+#     launch(postprocess, kwdict, reducers=[mv, HistogramReducer(100, range=(-1, 1))])
+#     mean, var = mv.result     # on rank 0, or on every rank with MeanVarReducer(allreduce=True)
+class Reducer(object):
+    """base class of the streaming reducers, subclasses implement _init, _add, _reduce and _result"""
+    def __init__(self, select=None, allreduce=False, root=0):
+        """
+        :param select: function picking the value to reduce from the result of func (default is the result itself)
+        :param allreduce: make the result available on every rank instead of root only
+        :param root: rank getting the result
+        """
+        self.select, self.allreduce, self.root = select, allreduce, root
+        self.n, self.shape, self.dtype, self.meta, self.result = 0, None, None, None, None
+
+    def add(self, x):
+        v = self.select(x) if self.select else x
+        if self.n == 0:
+            if isinstance(v, H5Data):
+                self.meta = {'timestamp': v.timestamp, 'data_attrs': v.data_attrs, 'run_attrs': v.run_attrs,
+                             'axes': v.axes}
+            v = np.asarray(v)
+            self.shape, self.dtype = v.shape, np.result_type(v.dtype, np.float64)
+            self._init()
+        self._add(np.asarray(v))
+        self.n += 1
+
+    def reduce(self):
+        """combine the accumulators of all ranks (every rank has to call it), return the result (None if no rank got
+        any value, or on ranks other than root unless allreduce)"""
+        if comm:
+            # ranks without any value start from an empty accumulator, shape and meta data come from the first rank
+            # that has one
+            owner = comm.allreduce(rank if self.n else size, op=MPI.MIN)
+            if owner == size:
+                return None
+            info = comm.bcast((self.shape, self.dtype, self.meta) if rank == owner else None, root=owner)
+            if not self.n:
+                self.shape, self.dtype, self.meta = info
+                self._init()
+            self._reduce()
+            if not self.allreduce and rank != self.root:
+                return None
+        elif not self.n:
+            return None
+        self.result = self._result()
+        return self.result
+
+    def _collective(self, buf, op):
+        """reduce the contiguous array buf in place (on root only unless allreduce)"""
+        if self.allreduce:
+            comm.Allreduce(MPI.IN_PLACE, buf, op=op)
+        elif rank == self.root:
+            comm.Reduce(MPI.IN_PLACE, buf, op=op, root=self.root)
+        else:
+            comm.Reduce(buf, None, op=op, root=self.root)
+
+    def _wrap(self, a):
+        if self.meta is None:
+            return a
+        return H5Data(a, timestamp=self.meta['timestamp'], data_attrs=self.meta['data_attrs'],
+                      run_attrs=self.meta['run_attrs'], axes=self.meta['axes'])
+
+
+class SumReducer(Reducer):
+    """sum of the values of all time steps"""
+    def _init(self):
+        self.acc = np.zeros(self.shape, dtype=self.dtype)
+
+    def _add(self, v):
+        self.acc += v
+
+    def _reduce(self):
+        self._collective(self.acc.reshape(-1), MPI.SUM)
+
+    def _result(self):
+        return self._wrap(self.acc)
+
+
+class MeanVarReducer(Reducer):
+    """mean and variance of the values of all time steps (Welford's algorithm), result is (mean, variance)"""
+    def __init__(self, ddof=0, **kwargs):
+        """
+        :param ddof: the variance is divided by count - ddof
+        :param kwargs: see Reducer
+        """
+        super(MeanVarReducer, self).__init__(**kwargs)
+        self.ddof = ddof
+
+    def _init(self):
+        self.count = np.zeros(1)
+        self.mean, self.m2 = np.zeros(self.shape, dtype=self.dtype), np.zeros(self.shape, dtype=self.dtype)
+
+    def _add(self, v):
+        self.count += 1
+        delta = v - self.mean
+        self.mean += delta / self.count[0]
+        self.m2 += delta * (v - self.mean)
+
+    def _reduce(self):
+        # global count and mean on every rank, then M2 = sum_i (M2_i + n_i * (mean_i - mean)^2)
+        n_i = self.count[0]
+        total = self.mean * n_i
+        comm.Allreduce(MPI.IN_PLACE, self.count, op=MPI.SUM)
+        comm.Allreduce(MPI.IN_PLACE, total.reshape(-1), op=MPI.SUM)
+        total /= self.count[0]
+        self.m2 += n_i * (self.mean - total) ** 2
+        self.mean = total
+        self._collective(self.m2.reshape(-1), MPI.SUM)
+
+    def _result(self):
+        return self._wrap(self.mean), self._wrap(self.m2 / (self.count[0] - self.ddof))
+
+
+class MinMaxReducer(Reducer):
+    """element-wise minimum and maximum of the values of all time steps, result is (min, max)"""
+    def _init(self):
+        self.min = np.full(self.shape, np.inf, dtype=self.dtype)
+        self.max = np.full(self.shape, -np.inf, dtype=self.dtype)
+
+    def _add(self, v):
+        np.minimum(self.min, v, out=self.min)
+        np.maximum(self.max, v, out=self.max)
+
+    def _reduce(self):
+        self._collective(self.min.reshape(-1), MPI.MIN)
+        self._collective(self.max.reshape(-1), MPI.MAX)
+
+    def _result(self):
+        return self._wrap(self.min), self._wrap(self.max)
+
+
+class HistogramReducer(Reducer):
+    """histogram of all the values of all time steps, result is (counts, bin edges)"""
+    def __init__(self, bins, range=None, **kwargs):
+        """
+        :param bins: bin edges, or number of bins in range
+        :param range: (min, max), needed if bins is a number since the bins have to be fixed before seeing the data
+        :param kwargs: see Reducer
+        """
+        super(HistogramReducer, self).__init__(**kwargs)
+        if np.ndim(bins) == 0 and range is None:
+            raise ValueError('HistogramReducer needs a range when bins is the number of bins')
+        self.edges = np.histogram_bin_edges([], bins=bins, range=range)
+
+    def add(self, x):
+        if self.n == 0:
+            self.shape, self.dtype = (len(self.edges) - 1,), np.float64
+            self._init()
+        v = self.select(x) if self.select else x
+        self.counts += np.histogram(np.ravel(v), bins=self.edges)[0]
+        self.n += 1
+
+    def _init(self):
+        self.counts = np.zeros(self.shape, dtype=self.dtype)
+
+    def _reduce(self):
+        self._collective(self.counts, MPI.SUM)
+
+    def _result(self):
+        return self.counts, self.edges
+
+
+def _interleave(n):
+    """time steps ordered as last, first, second last, second, ... so that expensive and cheap frames alternate"""
+    order = []
+    lo, hi = 0, n - 1
+    while lo <= hi:
+        order.append(hi)
+        if lo < hi:
+            order.append(lo)
+        lo, hi = lo + 1, hi - 1
+    return order
+
+
+def _dispatch(order):
+    """master of the dynamic scheduler: hand out the time steps in order to whichever rank asks for one"""
+    status = MPI.Status()
+    todo, stopped = deque(order), 0
+    while stopped < size - 1:
+        comm.recv(source=MPI.ANY_SOURCE, tag=_TAG_REQUEST, status=status)
+        if todo:
+            comm.send(todo.popleft(), dest=status.Get_source(), tag=_TAG_WORK)
+        else:
+            comm.send(None, dest=status.Get_source(), tag=_TAG_STOP)
+            stopped += 1
+
+
+def _request_timestep():
+    """worker side of the dynamic scheduler: ask rank 0 for a time step, None means there is no more"""
+    status = MPI.Status()
+    comm.send(None, dest=0, tag=_TAG_REQUEST)
+    i = comm.recv(source=0, tag=MPI.ANY_TAG, status=status)
+    return None if status.Get_tag() == _TAG_STOP else i
+
+
+class _ReadAhead(object):
+    """
+    read the files of all the keys of the time steps given by add() in a background thread, at most depth time steps
+    (and max_bytes of data) ahead of get(). depth=0 reads in get()
+    """
+    def __init__(self, fdict, depth=2, max_bytes=1024**3):
+        self.fdict, self.depth, self.max_bytes = fdict, depth, max_bytes
+        self.todo, self.ready, self.nbytes, self.closed = deque(), deque(), 0, False
+        self.cv = threading.Condition()
+        self.thread = threading.Thread(target=self.__run, daemon=True) if depth > 0 else None
+        if self.thread:
+            self.thread.start()
+
+    def __read(self, i):
+        return {k: read_h5(self.fdict[k][i]) for k in self.fdict}
+
+    def __run(self):
+        while True:
+            with self.cv:
+                while not self.closed and (not self.todo or (self.ready and (len(self.ready) >= self.depth or
+                                                                             self.nbytes >= self.max_bytes))):
+                    self.cv.wait()
+                if self.closed:
+                    return
+                i = self.todo.popleft()
+            try:
+                frames, err = self.__read(i), None
+            except Exception as e:  # returned by get() to the main thread
+                frames, err = {}, e
+            with self.cv:
+                self.ready.append((i, frames, err))
+                self.nbytes += sum(f.nbytes for f in frames.values())
+                self.cv.notify_all()
+
+    def add(self, i):
+        with self.cv:
+            self.todo.append(i)
+            self.cv.notify_all()
+
+    def get(self):
+        """(time step, {key: H5Data}, error) of the next time step, in the order they were added"""
+        if self.depth <= 0:
+            i = self.todo.popleft()
+            try:
+                return i, self.__read(i), None
+            except Exception as e:
+                return i, {}, e
+        with self.cv:
+            while not self.ready:
+                self.cv.wait()
+            i, frames, err = self.ready.popleft()
+            self.nbytes -= sum(f.nbytes for f in frames.values())
+            self.cv.notify_all()
+        return i, frames, err
+
+    def close(self):
+        """stop reading ahead, wait for the file being read"""
+        with self.cv:
+            self.closed = True
+            self.cv.notify_all()
+        if self.thread:
+            self.thread.join()
+
+
+class _BackgroundWriter(object):
+    """
+    save() that queues the data and writes it in a background thread, at most maxsize writes can be pending.
+    after() queues a function that is called once the writes queued before it succeeded
+    """
+    def __init__(self, write, maxsize=8):
+        self.write, self.errors = write, []
+        self.queue = queue.Queue(maxsize)
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+        self.thread.start()
+
+    def __run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            try:
+                if callable(item):
+                    if not self.errors:
+                        item()
+                else:
+                    self.write(*item)
+            except:
+                self.errors.append(traceback.format_exc())
+
+    def __call__(self, sd, dataset_name):
+        if self.errors:
+            raise IOError('Background write failed:\n' + self.errors[0])
+        # func is free to keep modifying sd once save() returns, what is written must be the data as it was saved
+        self.queue.put((sd.copy() if isinstance(sd, np.ndarray) else copy.deepcopy(sd), dataset_name))
+
+    def after(self, func):
+        self.queue.put(func)
+
+    def close(self):
+        """wait for the pending writes, raise IOError if any of them failed"""
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        if self.errors:
+            raise IOError('Background write failed:\n' + self.errors[0])
+
+
+def _stop_writes():
+    """after an error, wait for the queued writes so that the writer thread is not stopped in the middle of a file"""
+    if isinstance(save_funchook, _BackgroundWriter):
+        try:
+            save_funchook.close()
+        except IOError:  # the error being raised is the one to report
+            pass
+
+
+def _finish_writes():
+    if isinstance(save_funchook, _BackgroundWriter):
+        try:
+            save_funchook.close()
+        except:
+            print(traceback.format_exc(), flush=True)
+            if comm:
+                comm.Abort(errorcode=4)
+            raise
+
+
+def _report_utilization(nframes, busy, wall):
+    stats = comm.gather((nframes, busy, wall), root=0)
+    if rank == 0:
+        for r, (n, b, w) in enumerate(stats):
+            role = ' (master)' if r == 0 else ''
+            print('rank %d%s: %d frames, busy %.1f%% of %.1f s' % (r, role, n, 100. * b / w if w else 0., w),
+                  flush=True)
 
-    def save_funchook(sd, dataset_name):
-        odir = './PPR/' if not outdir else outdir
-        odir += '/' + dataset_name + '/'
-        # can't add barrier here due to uneven work load
-        if rank == 0:
-            if not os.path.exists(odir):  # prepare output dir
-                os.makedirs(odir)
-        # print('rank ' + str(rank) + 'writng to '+ odir)
-        write_h5(sd, path=odir, dataset_name=dataset_name)
 
-    fdict, sdict, fnum, kwargs, sfr = {}, {}, [], {}, []
+def launch(func, kw4func, outdir=None, afunc=None, schedule='static', workers=None, readahead=2,
+           readahead_bytes=1024**3, background_save=True, resume=False, retries=None, reducers=None):
+    """
+    wrap MPI calls & for loops around user defined postprocessing function
+    :param schedule: 'static' splits the time steps into one contiguous block per rank. 'dynamic' makes rank 0 a
+                     master that hands out the time steps on demand (expensive late frames interleaved with cheap early
+                     ones) to the other ranks, and prints the utilization of every rank at the end. my_timesteps holds
+                     the time steps of the results of each rank. dynamic falls back to static with less than 2 ranks
+    :param workers: number of processes working on the time steps when MPI is not available. func and the results
+                    are sent between processes so they have to be picklable (func is not pickled where processes are
+                    forked). None (default) processes the time steps in a serial loop
+    :param readahead: number of time steps whose files are read in the background while func is running, 0 reads
+                      them when they are needed
+    :param readahead_bytes: stop reading ahead when the time steps read ahead hold this many bytes
+    :param background_save: save() puts a copy of the data in a queue written by a background thread (all writes are
+                            finished before afunc is called)
+    :param resume: skip the time steps finished by previous runs with the same outdir and share the rest among the
+                   ranks. every rank records the finished time steps (after their save() calls are written) and the
+                   outputs of each of them in outdir/.manifest-<rank>.json. only the results of the time steps
+                   processed in this run are passed to afunc
+    :param retries: None (default) aborts on any error. otherwise an error while reading or processing a time step is
+                    printed and the time step is tried again (files are read again) up to retries times, then it is
+                    recorded as failed in the manifest and skipped (it is tried again with resume=True)
+    :param reducers: a Reducer or a list of them. every result of func is added to them as soon as func returns, and
+                     they are reduced across the ranks after the last time step (before afunc is called). the results
+                     themselves are only kept when afunc is given
+    """
+    # define the save function and make it global. it needs the outdir info from launch()
+    global save_funchook, _reducers, _keep_results
+    save_funchook = partial(_save_h5, outdir)
+    _reducers = [reducers] if isinstance(reducers, Reducer) else list(reducers or [])
+    _keep_results = afunc is not None
+    pool = not comm and workers and workers > 1
+    if background_save and not pool:
+        save_funchook = _BackgroundWriter(save_funchook)
+
+    fdict, sdict, fnum, kwargs, sfr, done = {}, {}, [], {}, [], set()
     if rank == 0:
         for k, v in kw4func.items():
             if isinstance(v, str):  # string is treated as
@@ -136,28 +539,19 @@ def launch(func, kw4func, outdir=None, afunc=None):
         if fnum.count(fnum[0]) != len(fnum):
             raise Exception('Number of files must be the same for all directories')
         # TODO(2) we should check if all quantities have exactly the same timestamp
+        done = _merge_manifests(_outdir(outdir), resume)
     if comm:
-        [fdict, sdict, kwargs, fnum] = comm.bcast([fdict, sdict, kwargs, fnum], root=0)
+        [fdict, sdict, kwargs, fnum, done] = comm.bcast([fdict, sdict, kwargs, fnum, done], root=0)
     # # divide the task
-    global total_time
+    global total_time, my_timesteps
     total_time = fnum[0]
-    my_share = (total_time - 1) // size + 1
-    i_begin = rank * my_share
-    i_end = (rank + 1) * my_share
-    if i_end > total_time:
-        i_end = total_time
-    # rank0 loop once to setup necessary dirs. not pretty but solve the racing condition
-    if comm:
-        try:
-            if rank == 0:
-                i_begin = 1
-                for k in fdict:
-                    kwargs[k] = read_h5(fdict[k][0])
-                sfr.append(func(**kwargs))  # store results for final aggregation
-            comm.Barrier()
-        except:
-            print(traceback.format_exc(), flush=True)
-            comm.Abort(errorcode=1)
+    if schedule not in ('static', 'dynamic'):
+        raise ValueError('Unknown schedule ' + repr(schedule) + ', use static or dynamic')
+    todo = [i for i in range(total_time) if i not in done]
+    if resume and rank == 0:
+        print('resuming: %d of %d time steps finished already' % (total_time - len(todo), total_time), flush=True)
+    my_timesteps = []
+    manifest = _Manifest(_outdir(outdir), resume or retries is not None)
 
     # load static files
     try:
@@ -167,13 +561,37 @@ def launch(func, kw4func, outdir=None, afunc=None):
         print(traceback.format_exc(), flush=True)
         if comm:
             comm.Abort(errorcode=2)
+        raise
 
     kwargs.update(sdict)  # here are all static parameters
 
-    for i in range(i_begin, i_end):
-        for k in fdict:
-            kwargs[k] = read_h5(fdict[k][i])
-        sfr.append(func(**kwargs))  # store results for final aggregation
+    start, busy = time.time(), 0.
+    try:
+        if pool:
+            _launch_pool(func, fdict, kwargs, sfr, workers, outdir, todo, manifest, retries)
+        elif schedule == 'dynamic' and size > 1:
+            if rank == 0:
+                _dispatch([todo[j] for j in _interleave(len(todo))])
+            else:
+                busy = _work_on_requests(func, fdict, kwargs, sfr, manifest, readahead, readahead_bytes, retries)
+        else:
+            my_share = (len(todo) - 1) // size + 1
+            busy = _work_on(todo[rank * my_share:(rank + 1) * my_share], func, fdict, kwargs, sfr, manifest,
+                            readahead, readahead_bytes, retries)
+    except:
+        _stop_writes()
+        raise
+    _finish_writes()
+    if schedule == 'dynamic' and size > 1:
+        _report_utilization(len(my_timesteps), busy, time.time() - start)
+    try:
+        for r in _reducers:
+            r.reduce()
+    except:
+        print(traceback.format_exc(), flush=True)
+        if comm:
+            comm.Abort(errorcode=5)
+        raise
 
     # it is up to the users to decide how to aggregate the results
     if afunc:
@@ -184,3 +602,202 @@ def launch(func, kw4func, outdir=None, afunc=None):
             if comm:
                 comm.Abort(errorcode=3)
 
+
+def _outdir(outdir):
+    return './PPR/' if not outdir else outdir
+
+
+def _read_frames(fdict, i):
+    return {k: read_h5(fdict[k][i]) for k in fdict}
+
+
+def _merge_manifests(odir, resume):
+    """
+    merge the manifests of previous runs into odir/.manifest.json (or remove them if resume is False), return the
+    finished time steps
+    """
+    files = glob.glob(os.path.join(odir, '.manifest*.json'))
+    merged = {'done': [], 'outputs': {}, 'failed': {}}
+    if resume:
+        for fn in files:
+            with open(fn) as f:
+                m = json.load(f)
+            merged['done'].extend(m['done'])
+            for name, steps in m['outputs'].items():
+                merged['outputs'].setdefault(name, []).extend(steps)
+            merged['failed'].update(m['failed'])
+        merged['done'] = sorted(set(merged['done']))
+        merged['failed'] = {k: v for k, v in merged['failed'].items() if int(k) not in merged['done']}
+        if files:
+            _write_json_atomic(os.path.join(odir, '.manifest.json'), merged)
+    for fn in files:
+        if not resume or os.path.basename(fn) != '.manifest.json':
+            os.remove(fn)
+    return set(merged['done'])
+
+
+def _write_json_atomic(filename, obj):
+    tmp = filename + '.tmp' + str(os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(obj, f)
+    os.replace(tmp, filename)
+
+
+class _Manifest(object):
+    """
+    the time steps finished by this rank, the outputs (save() dataset names) with the time steps that wrote them, and
+    the failed time steps, kept in odir/.manifest-<rank>.json which is rewritten atomically after every time step.
+    unless active (resume or retries), the file is only written once a time step has saved something, so that runs
+    which only collect results leave nothing behind
+    """
+    def __init__(self, odir, active=False):
+        self.filename = os.path.join(odir, '.manifest-' + str(rank) + '.json')
+        self.done, self.outputs, self.failed = [], {}, {}
+        self.active = active
+        self.lock = threading.Lock()
+
+    def finish(self, i, outputs):
+        """time step i is done and what it saved is on disk (may be called from the writer thread)"""
+        with self.lock:
+            self.done.append(i)
+            for name in outputs:
+                self.outputs.setdefault(name, []).append(i)
+            self.failed.pop(str(i), None)
+            self.active = self.active or bool(outputs)
+            if self.active:
+                self.__write()
+
+    def fail(self, i, error):
+        with self.lock:
+            self.failed[str(i)] = error
+            self.__write()
+
+    def __write(self):
+        if not os.path.exists(os.path.dirname(self.filename)):
+            os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        _write_json_atomic(self.filename, {'done': self.done, 'outputs': self.outputs, 'failed': self.failed})
+
+
+def _run_timestep(func, kwargs, fdict, i, frames, err, retries):
+    """
+    func on the frames of time step i (err is the error reading them). with retries, errors are printed and the time
+    step is tried again (reading its files again). return (True, result, names saved) or (False, error message, [])
+    """
+    attempt = 0
+    while True:
+        try:
+            if err is not None:
+                raise err
+            kwargs.update(frames)
+            del _saved[:]
+            return True, func(**kwargs), list(_saved)
+        except Exception:
+            if retries is None:
+                raise
+            msg = traceback.format_exc()
+            print('rank %d: time step %d failed (attempt %d of %d)\n%s' % (rank, i, attempt + 1, retries + 1, msg),
+                  flush=True)
+            if attempt >= retries:
+                return False, msg.strip().splitlines()[-1], []
+            attempt += 1
+            try:
+                frames, err = _read_frames(fdict, i), None
+            except Exception as e:
+                err = e
+
+
+def _finish_timestep(manifest, sfr, i, ok, res, saved):
+    if ok:
+        if _keep_results:
+            sfr.append(res)  # store results for final aggregation
+        for r in _reducers:
+            r.add(res)
+        my_timesteps.append(i)
+        # the time step is finished once what it saved is written
+        if isinstance(save_funchook, _BackgroundWriter):
+            save_funchook.after(partial(manifest.finish, i, saved))
+        else:
+            manifest.finish(i, saved)
+    else:
+        manifest.fail(i, res)
+
+
+def _work_on(timesteps, func, fdict, kwargs, sfr, manifest, readahead, readahead_bytes, retries):
+    """process the given time steps, return the busy time"""
+    # the next time frames are read in the background while func is working on the current one
+    reader, t0 = _ReadAhead(fdict, readahead, readahead_bytes), time.time()
+    try:
+        for i in timesteps:
+            reader.add(i)
+        for _ in timesteps:
+            i, frames, err = reader.get()
+            _finish_timestep(manifest, sfr, i, *_run_timestep(func, kwargs, fdict, i, frames, err, retries))
+    except:
+        print(traceback.format_exc(), flush=True)
+        if comm:
+            comm.Abort(errorcode=1)
+        raise
+    finally:
+        reader.close()
+    return time.time() - t0
+
+
+def _work_on_requests(func, fdict, kwargs, sfr, manifest, readahead, readahead_bytes, retries):
+    """process the time steps handed out by rank 0, return the busy time"""
+    # ask for readahead time steps more than the one func is working on, their files are read in the background
+    reader, assigned, more, busy = _ReadAhead(fdict, readahead, readahead_bytes), 0, True, 0.
+    try:
+        while True:
+            while more and assigned <= readahead:
+                i = _request_timestep()
+                more = i is not None
+                if more:
+                    reader.add(i)
+                    assigned += 1
+            if not assigned:
+                break
+            t0 = time.time()
+            i, frames, err = reader.get()
+            assigned -= 1
+            _finish_timestep(manifest, sfr, i, *_run_timestep(func, kwargs, fdict, i, frames, err, retries))
+            busy += time.time() - t0
+    except:
+        print(traceback.format_exc(), flush=True)
+        comm.Abort(errorcode=1)
+    finally:
+        reader.close()
+    return busy
+
+
+# every worker process of the pool gets func, the static parameters and the file lists once
+_pool_job = None
+
+
+def _init_pool_worker(func, kwargs, fdict, outdir, retries):
+    global _pool_job, save_funchook
+    _pool_job = func, kwargs, fdict, retries
+    save_funchook = partial(_save_h5, outdir)
+
+
+def _pool_timestep(i):
+    func, kwargs, fdict, retries = _pool_job
+    try:
+        frames, err = _read_frames(fdict, i), None
+    except Exception as e:
+        frames, err = None, e
+    return _run_timestep(func, dict(kwargs), fdict, i, frames, err, retries)
+
+
+def _launch_pool(func, fdict, kwargs, sfr, workers, outdir, todo, manifest, retries):
+    # fork (where available) so that func does not have to be picklable
+    ctx = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+    with ProcessPoolExecutor(workers, mp_context=ctx, initializer=_init_pool_worker,
+                             initargs=(func, kwargs, fdict, outdir, retries)) as pool:
+        # keep a few time steps per worker in flight, collect the results in time order
+        pending, todo = deque(), deque(todo)
+        while todo or pending:
+            while todo and len(pending) < 2 * workers:
+                i = todo.popleft()
+                pending.append((i, pool.submit(_pool_timestep, i)))
+            i, res = pending.popleft()
+            _finish_timestep(manifest, sfr, i, *res.result())
@@ -12,7 +12,9 @@ Define the OSIRIS HDF5 data class and basic functions.
 import numpy as np
 import re
 import copy as cp
+import weakref
 from fractions import Fraction as frac
+from math import gcd
 import warnings
 try:
     import xarray as xr
@@ -22,13 +24,20 @@ except ImportError:
 
 
 class DataAxis:
+    # a sliced uniform axis keeps the (min, increment) of the axis it was cut from plus an integer offset and stride,
+    # so that its coordinates are bitwise the same floats as the corresponding coordinates of the original axis
+    _i0, _di = 0, 1
+
     def __init__(self, axis_min=0., axis_max=1., axis_npoints=1, attrs=None, data=None):
         if data is None:
             if axis_min > axis_max:
                 raise Exception('illegal axis range: [ %(l)s, %(r)s ]' % {'l': axis_min, 'r': axis_max})
-            self.ax = np.linspace( axis_min, axis_max, axis_npoints, endpoint=False )
+            # uniform axis is stored analytically as (min, increment, npoints), coordinates are built when .ax is read
+            self._min, self._n, self._ax = axis_min, int(axis_npoints), None
+            self._inc = (axis_max - axis_min) / axis_npoints if axis_npoints else 0.
         else:
-            self.ax = data
+            # array-backed axis, the coordinates can be non-uniform
+            self._min, self._inc, self._n, self._ax = None, None, None, data
         # now make attributes for axis that are required..
         if attrs is None:
             self.attrs = {'UNITS': OSUnits('a.u.'), 'LONG_NAME': "", 'NAME': ""}
@@ -44,29 +53,93 @@ class DataAxis:
         if attrs:
             self.attrs.update(attrs)
 
+    @classmethod
+    def from_increment(cls, increment, npoints, offset=0, origin=0., attrs=None):
+        """
+        uniform axis of npoints coordinates (offset + i) * increment + origin. unlike DataAxis(min, max, npoints), where
+        the increment is (max - min) / npoints, the coordinate of offset + i == 0 is exactly origin (e.g. k = 0)
+        """
+        o = cls(origin, origin + abs(increment) * npoints, npoints, attrs=attrs)
+        o._inc, o._i0 = increment, offset
+        return o
+
     def __str__(self):
-        return ''.join([str(self.attrs['NAME']), ': [', str(self.ax[0]), ', ', str(self.max), '] ',
+        return ''.join([str(self.attrs['NAME']), ': [', str(self.min), ', ', str(self.max), '] ',
                         str(self.attrs['UNITS'])])
 
     def __repr__(self):
-        if len(self.ax) == 0:
+        if self.size == 0:
             return 'None'
         return ''.join([str(self.__class__.__module__), '.', str(self.__class__.__name__), ' at ', hex(id(self)),
-                        ': size=', str(self.ax.size), ', (min, max)=(', repr(self.ax[0]), ', ',
+                        ': size=', str(self.size), ', (min, max)=(', repr(self.min), ', ',
                         repr(self.max), '), ', repr(self.attrs)])
 
     def __getitem__(self, index):
+        if self._ax is None and isinstance(index, (int, np.integer)):  # no need to build the coordinates
+            return (range(self._n)[index] * self._di + self._i0) * self._inc + self._min
         return self.ax[index]
 
     def __eq__(self, other):
-        return (self.ax == other.ax).all()
+        if self.is_analytic and other.is_analytic:
+            return np.bool_(self._n == other._n and (self._n == 0 or self.min == other.min) and
+                            (self._n < 2 or self.increment == other.increment))
+        return np.bool_(np.array_equal(self.ax, other.ax))
+
+    def __copy__(self):
+        o = self.__class__.__new__(self.__class__)
+        o.__dict__.update(self.__dict__)
+        return o
+
+    def __deepcopy__(self, memo):
+        # the coordinates of an analytic axis are read-only so they can be shared
+        o = cp.copy(self)
+        o.attrs = cp.deepcopy(self.attrs, memo)
+        if not self.is_analytic:
+            o._ax = cp.deepcopy(self._ax, memo)
+        return o
 
-    # def __getstate__(self):
-    #     return self.ax[0], self.ax[-1], self.size, self.attrs
-    #
-    # def __setstate__(self, state):
-    #     self.ax = np.linspace(state[0], state[1], state[2])
-    #     self.attrs = state[3]
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.is_analytic:  # no need to send the coordinates around
+            state['_ax'] = None
+        return state
+
+    def __setstate__(self, state):
+        if 'ax' in state:  # pickled by older versions, which kept the coordinates in self.ax
+            state = dict(state)
+            state.update(_min=None, _inc=None, _n=None, _ax=state.pop('ax'))
+        self.__dict__.update(state)
+
+    @property
+    def ax(self):
+        if self._ax is None:
+            self._ax = (np.arange(self._n) * self._di + self._i0) * self._inc + self._min
+            self._ax.flags.writeable = False  # it has to agree with (min, increment, npoints)
+        return self._ax
+
+    @ax.setter
+    def ax(self, data):
+        self._min, self._inc, self._n, self._ax = None, None, None, data
+        self._i0, self._di = 0, 1
+
+    @property
+    def is_analytic(self):
+        """True if the axis is stored as (min, increment, npoints) instead of an array of coordinates"""
+        return self._n is not None
+
+    def subaxis(self, index):
+        """
+        return a new DataAxis corresponding to self.ax[index]. Slicing a uniform axis is O(1), the result is also uniform
+        :param index: a slice object
+        """
+        o = cp.copy(self)
+        o.attrs = self.attrs.copy()
+        if self.is_analytic:
+            r = range(self._n)[index]
+            o._i0, o._di, o._n, o._ax = r.start * self._di + self._i0, r.step * self._di, len(r), None
+        else:
+            o._ax = self._ax[index]
+        return o
 
     @property
     def name(self):
@@ -90,10 +163,12 @@ class DataAxis:
 
     @property
     def min(self):
-        return self.ax[0]
+        return self._i0 * self._inc + self._min if self.is_analytic else self.ax[0]
 
     @property
     def max(self):
+        if self.is_analytic:
+            return (self._n * self._di + self._i0) * self._inc + self._min if self._n > 1 else self.min
         try:
             return self.ax[-1] + self.ax[1] - self.ax[0]
         except IndexError:
@@ -101,13 +176,15 @@ class DataAxis:
 
     @property
     def size(self):
-        return self.ax.size
+        return self._n if self.is_analytic else self.ax.size
 
     def __len__(self):
-        return self.ax.size
+        return self.size
 
     @property
     def increment(self):
+        if self.is_analytic:
+            return self._inc * self._di if self._n > 1 else 0
         try:
             return self.ax[1] - self.ax[0]
         except IndexError:
@@ -150,96 +227,164 @@ class DataAxis:
         return 1.0, str(self.units)
 
 
+def _rat(f):
+    """convert a number or a string like '-1/2' to a reduced (numerator, denominator) pair"""
+    f = frac(f)
+    return f.numerator, f.denominator
+
+
+def _rat_add(p, q, sign=1):
+    n, d = p[0] * q[1] + sign * q[0] * p[1], p[1] * q[1]
+    g = gcd(n, d)
+    return n // g, d // g
+
+
+def _rat_mul(p, q):
+    n, d = p[0] * q[0], p[1] * q[1]
+    g = gcd(n, d)
+    return n // g, d // g
+
+
+def _rat_str(p):
+    return str(p[0]) if p[1] == 1 else str(p[0]) + '/' + str(p[1])
+
+
 class OSUnits:
     name = ('m_e', 'c', '\omega', 'e', 'n_0')
     disp_name = ['m_e', 'c', '\omega_p', 'e', 'n_0', 'a.u.']
     xtrnum = re.compile(r"(?<=\^)\d+|(?<=\^{).*?(?=})")
-
-    def __init__(self, s):
+    # OSUnits objects are immutable, so we hand out one shared instance per unit string and per power vector.
+    # the power vector is a tuple of (numerator, denominator) pairs of the powers of the base units in self.name
+    _interned = {}
+    _interned_max = 4096
+    _time, _frequency = ((0, 1), (0, 1), (-1, 1), (0, 1), (0, 1)), ((0, 1), (0, 1), (1, 1), (0, 1), (0, 1))
+    _velocity, _length = ((0, 1), (1, 1), (0, 1), (0, 1), (0, 1)), ((0, 1), (1, 1), (-1, 1), (0, 1), (0, 1))
+    _density = ((0, 1), (0, 1), (0, 1), (0, 1), (1, 1))
+
+    def __new__(cls, s='a.u.'):
         """
         :param s: string notation of the units. there should be whitespace around quantities and '/' dividing quantities
         """
         if isinstance(s, OSUnits):
-            self.power = cp.deepcopy(s.power)
-        else:
-            self.power = np.array([frac(0), frac(0), frac(0), frac(0), frac(0)])
-            if isinstance(s, bytes):
-                s = s.decode("utf-8")
-            if 'a.u.' != s:
-                s = re.sub('/(?![^{]*})', ' / ', s)
-                sl = s.split()
-                nominator = True
-                while sl:
-                    ss = sl.pop(0)
-                    if ss == '/':
-                        nominator = False
-                        continue
-                    for p, n in enumerate(OSUnits.name):
-                        if n == ss[0:len(n)]:
-                            res = OSUnits.xtrnum.findall(ss)  # extract numbers
-                            if res:
-                                self.power[p] = frac(res[0]) if nominator else -frac(res[0])
-                            else:
-                                self.power[p] = frac(1, 1) if nominator else frac(-1, 1)
-                            break
-                        elif ss in ['1', '2', '\pi', '2\pi']:
-                            break
-                    else:
-                        raise ValueError('Unknown unit: ' + re.findall(r'\w+', ss)[0])
+            return s
+        if isinstance(s, bytes):
+            s = s.decode("utf-8")
+        try:
+            return cls._interned[s]
+        except KeyError:
+            pass
+        o = cls._from_power(cls._parse(s))
+        if len(cls._interned) < cls._interned_max:
+            cls._interned[s] = o
+        return o
+
+    @classmethod
+    def _parse(cls, s):
+        power = [frac(0), frac(0), frac(0), frac(0), frac(0)]
+        if 'a.u.' != s:
+            s = re.sub('/(?![^{]*})', ' / ', s)
+            sl = s.split()
+            nominator = True
+            while sl:
+                ss = sl.pop(0)
+                if ss == '/':
+                    nominator = False
+                    continue
+                for p, n in enumerate(OSUnits.name):
+                    if n == ss[0:len(n)]:
+                        res = OSUnits.xtrnum.findall(ss)  # extract numbers
+                        if res:
+                            power[p] = frac(res[0]) if nominator else -frac(res[0])
+                        else:
+                            power[p] = frac(1, 1) if nominator else frac(-1, 1)
+                        break
+                    elif ss in ['1', '2', '\pi', '2\pi']:
+                        break
+                else:
+                    raise ValueError('Unknown unit: ' + re.findall(r'\w+', ss)[0])
+        return tuple((p.numerator, p.denominator) for p in power)
+
+    @classmethod
+    def _from_power(cls, power):
+        try:
+            return cls._interned[power]
+        except KeyError:
+            o = super(OSUnits, cls).__new__(cls)
+            o._power = power
+            if len(cls._interned) < cls._interned_max:
+                cls._interned[power] = o
+            return o
+
+    @property
+    def power(self):
+        """powers of the base units as a numpy array of fractions.Fraction"""
+        return np.array([frac(*p) for p in self._power])
 
     def tex(self):
         return '$' + self.__str__() + '$' if self.__str__() else self.__str__()
 
     def limit_denominator(self, max_denominator=64):
-        """call fractions.Fraction.limit_denominator method for each base unit"""
-        self.power = np.array([u.limit_denominator(max_denominator=max_denominator) for u in self.power])
+        """call fractions.Fraction.limit_denominator method for each base unit. return the new units"""
+        return self._from_power(tuple(_rat(frac(*p).limit_denominator(max_denominator=max_denominator))
+                                      for p in self._power))
 
     def is_time(self):
-        return (self.power == np.array([frac(0), frac(0), frac(-1), frac(0), frac(0)])).all()
+        return self._power == OSUnits._time
 
     def is_frequency(self):
-        return (self.power == np.array([frac(0), frac(0), frac(1), frac(0), frac(0)])).all()
+        return self._power == OSUnits._frequency
 
     def is_velocity(self):
-        return (self.power == np.array([frac(0), frac(1), frac(0), frac(0), frac(0)])).all()
+        return self._power == OSUnits._velocity
 
     def is_length(self):
-        return (self.power == np.array([frac(0), frac(1), frac(-1), frac(0), frac(0)])).all()
+        return self._power == OSUnits._length
 
     def is_density(self):
-        return (self.power == np.array([frac(0), frac(0), frac(0), frac(0), frac(1)])).all()
+        return self._power == OSUnits._density
 
     def __mul__(self, other):
-        res = OSUnits('a.u.')
-        res.power = self.power + other.power
-        return res
+        return self._from_power(tuple(_rat_add(p, q) for p, q in zip(self._power, other._power)))
 
     def __truediv__(self, other):
-        res = OSUnits('a.u.')
-        res.power = self.power - other.power
-        return res
+        return self._from_power(tuple(_rat_add(p, q, -1) for p, q in zip(self._power, other._power)))
 
     __floordiv__ = __truediv__
     __div__ = __truediv__
 
     def __pow__(self, other, modulo=1):
-        res = OSUnits('a.u.')
-        res.power = self.power * frac(other)
-        return res
+        r = _rat(other)
+        return self._from_power(tuple(_rat_mul(p, r) for p in self._power))
 
     def __eq__(self, other):
-        return (self.power == other.power).all()
+        try:
+            return self._power == other._power
+        except AttributeError:
+            return NotImplemented
+
+    def __hash__(self):
+        return hash(self._power)
+
+    # immutable, no need to copy
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return self._from_power, (self._power,)
 
     def __str__(self):
-        disp = ''.join(['' if p == 0 else n + " " if p == 1 else n + '^{' + str(p) + '} '
-                        for n, p in zip(OSUnits.disp_name[:-1], self.power)])
+        disp = ''.join(['' if p[0] == 0 else n + " " if p == (1, 1) else n + '^{' + _rat_str(p) + '} '
+                        for n, p in zip(OSUnits.disp_name[:-1], self._power)])
         if not disp:
             return OSUnits.disp_name[-1]
         return disp
 
     def __repr__(self):
         return ''.join([str(self.__class__.__module__), '.', str(self.__class__.__name__), ' at ', hex(id(self)),
-                        ': ', repr(self.name), '=(', ', '.join([str(fr) for fr in self.power]), ')'])
+                        ': ', repr(self.name), '=(', ', '.join([_rat_str(p) for p in self._power]), ')'])
 
     def encode(self, *args, **kwargs):
         return self.__str__().encode(*args, **kwargs)
@@ -250,17 +395,18 @@ class _LocIndexer(object):
 
     def label_slice2int_slice(self, i, slc):
         bnd = (slc.start, slc.stop, slc.step)
-        return slice(*H5Data.get_index_slice(self.__data.axes[i], bnd))
+        return slice(*H5Data.get_index_slice(self.__data._axes[i], bnd))
 
     def label2int(self, i, label):
-        ax = self.__data.axes[i]
+        ax = self.__data._axes[i]
         ind = int(round(max(label - ax.min, 0) / ax.increment)) if ax.increment > 0 else -1
         return min(ind, self.__data.shape[i] - 1)
 
     def iterable2int_list(self, i, iterable):
-        return H5Data.get_index_list(self.__data.axes[i], iterable)
+        return H5Data.get_index_list(self.__data._axes[i], iterable)
 
-    def __convert_index(self, index):
+    def convert_index(self, index):
+        """convert an index in axis units to integer index"""
         try:
             iter(index)
             idxl = index
@@ -291,10 +437,10 @@ class _LocIndexer(object):
         return converted
 
     def __getitem__(self, index):
-        return self.__data[tuple(self.__convert_index(index))]
+        return self.__data[tuple(self.convert_index(index))]
 
     def __setitem__(self, index, value):
-        self.__data.values[tuple(self.__convert_index(index))] = value
+        self.__data.values[tuple(self.convert_index(index))] = value
 
 
 # Important: the first occurrence of serial numbers before '.' must be the time stamp information
@@ -318,22 +464,86 @@ class H5Data(np.ndarray):
             obj.axes = cp.deepcopy(axes)   # the elements are numpy arrays
         return obj
 
+    # metadata fields shared between an H5Data and its views, see __array_finalize__
+    _meta_fields = ('data_attrs', 'run_attrs', 'axes')
+
     def __array_finalize__(self, obj):
         if obj is None:
+            self.timestamp, self._data_attrs, self._run_attrs, self._axes = '0' * 6, {}, {}, []
+            self._cow, self._peers = set(), {}
             return
         self.timestamp = getattr(obj, 'timestamp', '0' * 6)
-        # self.name = getattr(obj, 'name', 'data')
-#         if self.base is obj:
-#             self.data_attrs = getattr(obj, 'data_attrs', {})
-#             self.run_attrs = getattr(obj, 'run_attrs', {})
-#             self.axes = getattr(obj, 'axes', [])
-#         else:
-#             self.data_attrs = cp.deepcopy(getattr(obj, 'data_attrs', {}))
-#             self.run_attrs = cp.deepcopy(getattr(obj, 'run_attrs', {}))
-#             self.axes = cp.deepcopy(getattr(obj, 'axes', []))
-        self.data_attrs, self.run_attrs, self.axes = (cp.deepcopy(getattr(obj, 'data_attrs', {})),
-                                                      cp.deepcopy(getattr(obj, 'run_attrs', {})),
-                                                      cp.deepcopy(getattr(obj, 'axes', [])))
+        # views, slices and ufunc outputs share the metadata of obj instead of deep copying it. the shared fields are
+        # recorded in _cow (copy-on-write) on both sides; whoever asks for a mutable field first gets a private copy.
+        # _peers keeps weak references to the H5Data sharing each field, so the copy is skipped once the others are
+        # gone, e.g. after temporary views or reductions of self have been thrown away.
+        self._data_attrs = getattr(obj, '_data_attrs', {})
+        self._run_attrs = getattr(obj, '_run_attrs', {})
+        self._axes = getattr(obj, '_axes', [])
+        self._cow, self._peers = set(H5Data._meta_fields), {}
+        if isinstance(obj, H5Data):
+            obj._cow.update(H5Data._meta_fields)
+            me = weakref.ref(self)
+            for field in H5Data._meta_fields:
+                peers = obj._peers.get(field)
+                if peers is None:
+                    peers = obj._peers[field] = {id(obj): weakref.ref(obj)}
+                elif len(peers) > 64:  # forget the dead ones every now and then
+                    for k in [k for k, r in peers.items() if r() is None]:
+                        del peers[k]
+                peers[id(self)] = me
+                self._peers[field] = peers
+
+    def _own(self, field):
+        """return the metadata field, making a private copy first if it is shared with other H5Data"""
+        if field in self._cow:
+            if self._leave(field):
+                setattr(self, '_' + field, cp.deepcopy(getattr(self, '_' + field)))
+            self._cow.discard(field)
+        return getattr(self, '_' + field)
+
+    def _leave(self, field):
+        """stop sharing the metadata field, return True if other H5Data may still reference it"""
+        peers = self._peers.pop(field, None)
+        if peers is None:  # not shared, or shared with something we do not keep track of (e.g. after unpickling)
+            return field in self._cow
+        peers.pop(id(self), None)
+        return any(r() is not None for r in peers.values())
+
+    def _share_axes(self, axes):
+        """set axes that may still reference DataAxis objects of other H5Data (they will be copied on write)"""
+        self._axes = axes
+        self._cow.add('axes')
+
+    @property
+    def data_attrs(self):
+        return self._own('data_attrs')
+
+    @data_attrs.setter
+    def data_attrs(self, d):
+        self._leave('data_attrs')
+        self._data_attrs = d
+        self._cow.discard('data_attrs')
+
+    @property
+    def run_attrs(self):
+        return self._own('run_attrs')
+
+    @run_attrs.setter
+    def run_attrs(self, d):
+        self._leave('run_attrs')
+        self._run_attrs = d
+        self._cow.discard('run_attrs')
+
+    @property
+    def axes(self):
+        return self._own('axes')
+
+    @axes.setter
+    def axes(self, axes):
+        self._leave('axes')
+        self._axes = axes
+        self._cow.discard('axes')
 
     @property
     def T(self):
@@ -341,7 +551,7 @@ class H5Data(np.ndarray):
 
     @property
     def name(self):
-        return self.data_attrs.get('NAME', '')
+        return self._data_attrs.get('NAME', '')
 
     @name.setter
     def name(self, s):
@@ -351,7 +561,7 @@ class H5Data(np.ndarray):
     def long_name(self):
         warnings.warn(".long_name will be removed from future version. "
                       "Please use .label instead", DeprecationWarning)
-        return self.data_attrs.get('LONG_NAME', '')
+        return self._data_attrs.get('LONG_NAME', '')
 
     @long_name.setter
     def long_name(self, s):
@@ -361,7 +571,7 @@ class H5Data(np.ndarray):
 
     @property
     def label(self):
-        return self.data_attrs.get('LONG_NAME', '')
+        return self._data_attrs.get('LONG_NAME', '')
 
     @label.setter
     def label(self, s):
@@ -369,7 +579,7 @@ class H5Data(np.ndarray):
 
     @property
     def units(self):
-        return self.data_attrs.get('UNITS', OSUnits('a.u.'))
+        return self._data_attrs.get('UNITS', OSUnits('a.u.'))
 
     @property
     def values(self):
@@ -383,6 +593,11 @@ class H5Data(np.ndarray):
     # need the following two function for mpi4py high level function to work correctly
     def __setstate__(self, state, *args):
         self.__dict__ = state[-1]
+        self._peers = {}  # the unpickled metadata belongs to this object only
+        if '_cow' not in self.__dict__:  # pickled by older versions, which kept the metadata in public attributes
+            for field in H5Data._meta_fields:
+                self.__dict__['_' + field] = self.__dict__.pop(field)
+            self._cow = set()
         super(H5Data, self).__setstate__(state[:-1], *args)
 
     # It looks like mpi4py/ndarray use reduce for pickling. One would think setstate/getstate pair should also work but
@@ -390,7 +605,7 @@ class H5Data(np.ndarray):
     # Luckily ndarray doesn't use __dict__ so we can pack everything in it.
     def __reduce__(self):
         ps = super(H5Data, self).__reduce__()
-        ms = ps[2] + (self.__dict__,)
+        ms = ps[2] + ({k: v for k, v in self.__dict__.items() if k != '_peers'},)
         return ps[0], ps[1], ms
 
     def __getstate__(self):
@@ -401,14 +616,14 @@ class H5Data(np.ndarray):
             return str(self.values)
         else:
             return ''.join([self.name, '-', self.timestamp, ', shape: ', str(self.shape), ', time:',
-                            str(self.run_attrs['TIME']), ' [', str(self.run_attrs['TIME UNITS']), ']\naxis:\n  ',
-                            '\n  '.join([str(ax) for ax in self.axes]) if len(self.axes) else 'None'])
+                            str(self._run_attrs['TIME']), ' [', str(self._run_attrs['TIME UNITS']), ']\naxis:\n  ',
+                            '\n  '.join([str(ax) for ax in self._axes]) if len(self._axes) else 'None'])
 
     def __repr__(self):
         return ''.join([str(self.__class__.__module__), '.', str(self.__class__.__name__), ' at ', hex(id(self)),
                         ', shape', str(self.shape), ',\naxis:\n  ',
-                        '\n  '.join([repr(ax) for ax in self.axes]) if len(self.axes) else 'None',
-                        '\ndata_attrs: ', repr(self.data_attrs), '\nrun_attrs:', repr(self.run_attrs)])
+                        '\n  '.join([repr(ax) for ax in self._axes]) if len(self._axes) else 'None',
+                        '\ndata_attrs: ', repr(self._data_attrs), '\nrun_attrs:', repr(self._run_attrs)])
 
     def __getitem__(self, index):
         """I am inclined to support only basic indexing/slicing. Otherwise it is too difficult to define the axes.
@@ -424,29 +639,32 @@ class H5Data(np.ndarray):
             idxl = index
         except TypeError:
             idxl = [index]
+        if not isinstance(v, H5Data):  # a scalar
+            return v
         try:
-            converted, nn, dn = [], ndim - len(idxl) + idxl.count(None) + 1, 0
+            # build a new axes list, only the sliced axes are copied. the rest are shared with self
+            axes, nn, dn = list(v._axes), ndim - len(idxl) + idxl.count(None) + 1, 0
             for idx in idxl:
                 if isinstance(idx, int):  # i is a trivial dimension now
-                    try:
-                        del v.axes[dn]
-                    except AttributeError:
-                        break
+                    del axes[dn]
                 elif isinstance(idx, slice):  # also slice the axis
-                    v.axes[dn].ax = v.axes[dn].ax[idx]
+                    axes[dn] = axes[dn].subaxis(idx)
                     dn += 1
                 elif idx is Ellipsis:  # let's fast forward to the next explicitly referred axis
                     dn += nn
                 elif idx is None:  # in numpy None means newAxis
-                    v.axes.insert(dn, DataAxis(0., 1., 1))
+                    axes.insert(dn, DataAxis(0., 1., 1))
                     dn += 1
                 else:  # type not supported
                     return v.view(np.ndarray)
         except:
             return v.view(np.ndarray)
+        v._share_axes(axes)
         return v
 
     def __getattr__(self, label):
+        if label.startswith('_'):  # private attributes (e.g. metadata not set yet) are never axis names
+            raise AttributeError(label)
         try:
             return getattr(self.values, label)
         except AttributeError:  # maybe it is an axis name
@@ -454,30 +672,31 @@ class H5Data(np.ndarray):
                 ind = self.index_of(label)
             except ValueError:
                 raise AttributeError()
-            axes = np.meshgrid(*reversed([x.ax for x in self.axes]), sparse=True)
+            axes = np.meshgrid(*reversed([x.ax for x in self._axes]), sparse=True)
             return axes[self.ndim-1-ind].copy()
 
     def meta2dict(self):
         """return a deep copy of the meta data as a dictionary"""
-        return cp.deepcopy(self.__dict__)
+        return cp.deepcopy({'timestamp': self.timestamp, 'data_attrs': self._data_attrs,
+                            'run_attrs': self._run_attrs, 'axes': self._axes})
 
     def transpose(self, *axes):
         v = super(H5Data, self).transpose(*axes)
-        if axes is () or axes[0] is None:  # axes is none, numpy default is to reverse the order
-            axes = range(len(v.axes)-1, -1, -1)
+        if axes == () or axes[0] is None:  # axes is none, numpy default is to reverse the order
+            axes = range(len(v._axes)-1, -1, -1)
         try:                               # called like transpose(2, 1, 0)
-            v.axes = [self.axes[i] for i in axes]
+            v._share_axes([self._axes[i] for i in axes])
         except TypeError:                  # called like transpose([2, 1, 0])
-            v.axes = [self.axes[i] for i in axes[0]]
+            v._share_axes([self._axes[i] for i in axes[0]])
         return v
 
     def __del_axis(self, axis):
         # axis cannot be None
         if isinstance(axis, int):
-            del self.axes[axis]
-        else:
-            # remember axis index can be negative
-            self.axes = [v for i, v in enumerate(self.axes) if i not in axis and i - self.ndim not in axis]
+            axis = (axis,)
+        # remember axis index can be negative
+        nd = len(self._axes)
+        self._share_axes([v for i, v in enumerate(self._axes) if i not in axis and i - nd not in axis])
 
     def __ufunc_with_axis_handled(self, func, *args, **kwargs):
         try:
@@ -530,7 +749,9 @@ class H5Data(np.ndarray):
 
     def swapaxes(self, axis1, axis2):
         o = super(H5Data, self).swapaxes(axis1, axis2)
-        o.axes[axis1], o.axes[axis2] = o.axes[axis2], o.axes[axis1]
+        axes = list(o._axes)
+        axes[axis1], axes[axis2] = axes[axis2], axes[axis1]
+        o._share_axes(axes)
         return o
 
     def var(self, axis=None, dtype=None, out=None, ddof=0, keepdims=False):
@@ -540,8 +761,12 @@ class H5Data(np.ndarray):
         v = super(H5Data, self).squeeze(axis=axis)
         if axis is None:
             axis = [i for i, d in enumerate(self.shape) if d <= 1]
-        for i in reversed(axis):
-            del v.axes[i]
+        elif isinstance(axis, int):
+            axis = (axis,)
+        axes = list(v._axes)
+        for i in sorted(axis, reverse=True):
+            del axes[i]
+        v._share_axes(axes)
         return v
 
     def __array_wrap__(self, out, context=None):
@@ -565,9 +790,9 @@ class H5Data(np.ndarray):
                     if not isinstance(context[1][0], H5Data):  # nominator has no unit
                         out.data_attrs['UNITS'] **= '-1'
                     else:
-                        out.data_attrs['UNITS'] = context[1][0].data_attrs['UNITS'] / context[1][1].data_attrs['UNITS']
+                        out.data_attrs['UNITS'] = context[1][0]._data_attrs['UNITS'] / context[1][1]._data_attrs['UNITS']
                 else:  # op is multiply
-                    out.data_attrs['UNITS'] = context[1][0].data_attrs['UNITS'] * context[1][1].data_attrs['UNITS']
+                    out.data_attrs['UNITS'] = context[1][0]._data_attrs['UNITS'] * context[1][1]._data_attrs['UNITS']
             except (AttributeError, KeyError):  # .data_attrs['UNITS'] failed
                 pass
         return np.ndarray.__array_wrap__(self, out, context)
@@ -647,7 +872,7 @@ class H5Data(np.ndarray):
 
     def index_of(self, axis_name):
         """return the index of the axis given its name. raise ValueError if not found"""
-        axn = [ax.name for ax in self.axes]
+        axn = [ax.name for ax in self._axes]
         try:
             if isinstance(axis_name, str):
                 return axn.index(axis_name)
@@ -658,7 +883,7 @@ class H5Data(np.ndarray):
 
     def has_axis(self, axis_name):
         """check if H5Data has axis with name axis_name"""
-        return axis_name in [ax.name for ax in self.axes]
+        return axis_name in [ax.name for ax in self._axes]
 
     def sel(self, new=False, **bound):
         """
@@ -702,7 +927,7 @@ class H5Data(np.ndarray):
             return self
         if H5Data.__check_bound_depth(bound) == 1:
             bound = (bound,)
-        index = self.__get_axes_bound(self.axes, bound)
+        index = self.__get_axes_bound(self._axes, bound)
         if new:
             return cp.deepcopy(self[index])
         else:
@@ -742,9 +967,9 @@ class H5Data(np.ndarray):
             val = (val,)
         rec, vallen = [], len(val)
         for i, bnd in enumerate(bound):
-            index = [self.__get_axes_bound(self.axes, bnd)]
+            index = [self.__get_axes_bound(self._axes, bnd)]
             if symmetric:
-                index.append(H5Data.__get_symmetric_bound(self.axes, index[0]))
+                index.append(H5Data.__get_symmetric_bound(self._axes, index[0]))
             for idx in index:
                 idx = tuple(idx)
                 if inverse_select:  # record original data for later use
@@ -842,3 +1067,37 @@ class PartData(np.ndarray):
             self.attrs['TIMESTAMP'] = str(ts)
         except ValueError:
             raise ValueError('Illigal timestamp format, must be integer of base 10')
+
+
+if __name__ == '__main__':
+    # benchmark the per-view overhead of H5Data. views share the metadata of their parent (copy-on-write). the eager
+    # copy every view used to pay is timed on the same slice by making all of its metadata private right away
+    import timeit
+    nviews = 10000
+    axes = [DataAxis(0., 10., 64, attrs={'NAME': 'x' + str(i), 'LONG_NAME': 'x_' + str(i), 'UNITS': 'c / \omega_p'})
+            for i in (2, 1)]
+    h5d = H5Data(np.zeros((64, 64)), timestamp='000100', axes=axes,
+                 data_attrs={'NAME': 'e1', 'LONG_NAME': 'E_1', 'UNITS': 'm_e c \omega_p / e'},
+                 run_attrs={'TIME': np.array([100.]), 'TIME UNITS': OSUnits('1 / \omega_p'), 'ITER': np.array([1000])})
+    arr = h5d.view(np.ndarray)
+
+    t_nd = timeit.timeit(lambda: arr[1:-1, ::2], number=nviews) / nviews
+    t_view = timeit.timeit(lambda: h5d[1:-1, ::2], number=nviews) / nviews
+    t_ufunc = timeit.timeit(lambda: h5d * 2, number=nviews) / nviews
+
+    def eager_view():
+        v = h5d[1:-1, ::2]
+        return v.data_attrs, v.run_attrs, v.axes  # each getter deep copies what is still shared with h5d
+
+    t_eager = timeit.timeit(eager_view, number=nviews) / nviews
+    print('per-view time (us):')
+    print('  numpy.ndarray slice                      : %8.2f' % (t_nd * 1e6))
+    print('  H5Data slice (shared metadata)           : %8.2f' % (t_view * 1e6))
+    print('  H5Data ufunc (shared metadata)           : %8.2f' % (t_ufunc * 1e6))
+    print('  H5Data slice (eager metadata copy)       : %8.2f' % (t_eager * 1e6))
+
+    # mutating a view must not leak back into its parent
+    v = h5d[2:10, :]
+    v.name, v.axes[0].attrs['NAME'] = 'view', 'y'
+    assert h5d.name == 'e1' and h5d.axes[0].name == 'x2' and h5d.axes[0].size == 64
+    assert v.axes[0].size == 8 and v.axes[1] is not h5d.axes[1]
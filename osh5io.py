@@ -18,7 +18,15 @@ __status__ = "Development"
 
 import h5py
 import os
+import copy as cp
+import json
+import bisect
+import threading
 import numpy as np
+from collections import OrderedDict
+from functools import partial
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from osh5def import H5Data, PartData, fn_rule, DataAxis, OSUnits
 try:
     import zdf
@@ -55,25 +63,234 @@ except ImportError:
         raise NotImplementedError('Cannot import zdf reader, zdf format not supported')
 
 
-def read_grid(filename, path=None, axis_name="AXIS/AXIS"):
+class GridCache(object):
+    """
+    A process-wide LRU cache of the data read by read_grid, bounded by the total number of bytes. Entries are keyed by
+    the absolute file name, its mtime and size, and the requested region; cached arrays are read-only and every hit
+    returns a new view so that the meta data of the cached entry is never modified (see H5Data copy-on-write).
+    The cache is off (max_bytes=0) until it is given a budget, e.g.
+            osh5io.grid_cache.resize(4 * 1024**3)   # keep up to 4GB of data
+            osh5io.grid_cache.info()                # {'hits': ..., 'misses': ..., 'evictions': ..., 'nbytes': ...}
+    """
+    def __init__(self, max_bytes=0):
+        self.max_bytes = max_bytes
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+        self.nbytes, self.hits, self.misses, self.evictions = 0, 0, 0, 0
+
+    def resize(self, max_bytes):
+        """set the byte budget, 0 disables the cache. entries are evicted if the cache is now too large"""
+        with self.__lock:
+            self.max_bytes = max_bytes
+            self.__evict()
+
+    def clear(self):
+        """drop all entries and reset the counters"""
+        with self.__lock:
+            self.__entries.clear()
+            self.nbytes, self.hits, self.misses, self.evictions = 0, 0, 0, 0
+
+    def info(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'entries': len(self.__entries), 'nbytes': self.nbytes, 'max_bytes': self.max_bytes}
+
+    def __evict(self):
+        while self.nbytes > self.max_bytes and self.__entries:
+            _, (_, nb) = self.__entries.popitem(last=False)
+            self.nbytes -= nb
+            self.evictions += 1
+
+    @staticmethod
+    def __views(data):
+        return [d.view() for d in data] if isinstance(data, list) else data.view()
+
+    def get(self, key, read):
+        """return the cached data of key, call read() and keep the result if it is not in the cache"""
+        with self.__lock:
+            if key in self.__entries:
+                self.__entries.move_to_end(key)
+                self.hits += 1
+                return self.__views(self.__entries[key][0])
+            self.misses += 1
+        data = read()
+        dl = data if isinstance(data, list) else [data]
+        nb = sum(d.nbytes for d in dl)
+        if nb > self.max_bytes:
+            return data
+        for d in dl:
+            d.flags.writeable = False
+        with self.__lock:
+            if key not in self.__entries:
+                self.__entries[key] = data, nb
+                self.nbytes += nb
+                self.__evict()
+        return self.__views(data)
+
+
+grid_cache = GridCache()
+
+
+def read_grid(filename, path=None, axis_name="AXIS/AXIS", lazy=False, bound=None, stride=None, cache=True, mmap=False,
+              driver=None):
     """
     Read grid data from Osiris/OSHUN output. Data can be in hdf5 or zdf format
+    :param lazy, bound, stride, mmap, driver: see read_h5. zdf files are always read into memory before bound and stride are applied
+    :param cache: look up (and save) the data in grid_cache if the cache is enabled. the returned data is read-only
+                  when the cache is used. lazy reads are never cached
     """
+    if cache and not lazy and grid_cache.max_bytes > 0:
+        where = path + '/' if path else ''  # the readers open path + '/' + filename
+        fn = filename
+        if not os.path.exists(where + fn):
+            fn = filename + '.h5' if os.path.exists(where + filename + '.h5') else filename + '.zdf'
+        try:
+            st = os.stat(where + fn)
+        except OSError:  # let the reader complain about it
+            pass
+        else:
+            key = (os.path.abspath(where + fn), st.st_mtime_ns, st.st_size, repr(bound), repr(stride), bool(mmap),
+                   axis_name)
+            return grid_cache.get(key, lambda: read_grid(fn, path=path, axis_name=axis_name, bound=bound,
+                                                         stride=stride, cache=False, mmap=mmap, driver=driver))
     ext = os.path.basename(filename).split(sep='.')[-1]
 
     if ext == 'h5':
-        return read_h5(filename, path=path, axis_name="AXIS/AXIS")
+        return read_h5(filename, path=path, axis_name="AXIS/AXIS", lazy=lazy, bound=bound, stride=stride, mmap=mmap,
+                       driver=driver)
     elif ext == 'zdf':
-        return read_zdf(filename, path=path)
+        return __window_zdf(read_zdf(filename, path=path), bound, stride)
     else:
         # the file extension may not be specified, trying all supported formats
         try:
-            return read_h5(filename+'.h5', path=path, axis_name="AXIS/AXIS")
+            return read_h5(filename+'.h5', path=path, axis_name="AXIS/AXIS", lazy=lazy, bound=bound, stride=stride,
+                           mmap=mmap, driver=driver)
         except OSError:
-            return read_zdf(filename+'.zdf', path=path)
+            return __window_zdf(read_zdf(filename+'.zdf', path=path), bound, stride)
+
 
+_reader_pools = {}
+
+
+def _reader_pool(workers, processes):
+    """executors of read_many are created once and reused"""
+    key = (workers, processes)
+    if key not in _reader_pools:
+        _reader_pools[key] = ProcessPoolExecutor(workers) if processes else ThreadPoolExecutor(workers)
+    return _reader_pools[key]
+
+
+def _read_small_in_core(filename, small_file, **kwargs):
+    try:
+        if os.path.getsize(filename) < small_file:
+            kwargs['driver'] = 'core'
+    except OSError:  # e.g. file name without extension, let read_grid figure it out
+        pass
+    return read_grid(filename, **kwargs)
 
-def read_h5(filename, path=None, axis_name="AXIS/AXIS"):
+
+def read_many(files, workers=2, prefetch=None, processes=False, small_file=64 * 1024**2, **kwargs):
+    """
+    read a list of files with read_grid, return an iterator of the data in the same order as files. Up to prefetch
+    files are read ahead in the background so that reading overlaps with whatever is done to the data.
+    Usage:
+            for d in read_many(sorted(glob.glob('MS/FLD/e1/*.h5')), workers=4):
+                do_something(d)
+    :param files: list of file names
+    :param workers: number of threads (or processes) reading the files. 0 means reading in the calling thread
+    :param prefetch: max number of files read ahead, default is 2 * workers
+    :param processes: use a process pool instead of a thread pool. HDF5 calls are serialized within one process so
+                      threads mostly help overlapping I/O with computation, processes can also decode files in parallel
+                      at the cost of sending the data back through pipes
+    :param small_file: h5 files smaller than this number of bytes are read into memory in one go (h5py 'core'
+                       driver) which saves a lot of small reads. not used for lazy or mmap reads
+    :param kwargs: other keyword arguments are passed to read_grid
+    """
+    if kwargs.get('lazy') or kwargs.get('mmap'):
+        small_file = 0
+    return map_files(partial(_read_small_in_core, small_file=small_file, **kwargs), files, workers=workers,
+                     prefetch=prefetch, processes=processes)
+
+
+def map_files(func, files, workers=2, prefetch=None, processes=False):
+    """
+    return an iterator of func(f) for f in files, in order. At most prefetch calls are running or finished but not yet
+    consumed at any time. The thread/process pools are shared with read_many and reused between calls.
+    With processes=True func (and whatever it returns) must be picklable, e.g. a module level function or a
+    functools.partial of it. See read_many for the other parameters.
+    """
+    if not workers or workers < 1:
+        for fn in files:
+            yield func(fn)
+        return
+    prefetch = prefetch if prefetch else 2 * workers
+    pool, pending, fit = _reader_pool(workers, processes), deque(), iter(files)
+    try:
+        for fn in fit:
+            pending.append(pool.submit(func, fn))
+            if len(pending) >= prefetch:
+                break
+        while pending:
+            d = pending.popleft().result()
+            for fn in fit:
+                pending.append(pool.submit(func, fn))
+                break
+            yield d
+    finally:  # the caller may stop early
+        for f in pending:
+            f.cancel()
+
+
+def __window_zdf(data, bound, stride):
+    if bound is None and stride is None:
+        return data
+    return data[_bound_to_index(data, bound, stride)]
+
+
+def _bound_to_index(data, bound=None, stride=None):
+    """
+    convert a bound in axis units (and an optional stride) to an integer index of data (H5Data or LazyH5Data)
+    :param bound: either a dict of {axis_name: bound} as in H5Data.sel, e.g. {'x1': (10., 20.), 'x2': 0.5},
+                  or an index in axis units as in H5Data.loc, e.g. (slice(10., 20.), 0.5)
+    :param stride: int or tuple of int (one for each axis), take every stride-th point
+    """
+    if bound is None:
+        ind = [slice(None)] * data.ndim
+    elif isinstance(bound, dict):
+        ind = [slice(None)] * data.ndim
+        for axn, bnd in bound.items():
+            ind[data.index_of(axn)] = bnd if isinstance(bnd, (slice, int, float)) else slice(*bnd)
+        ind = data.loc.convert_index(tuple(ind))
+    else:
+        ind = data.loc.convert_index(bound)
+    if stride is not None:
+        stride = (stride,) * data.ndim if isinstance(stride, (int, np.integer)) else tuple(stride)
+        dim = 0
+        for i, idx in enumerate(ind):
+            if idx is None:  # newaxis
+                continue
+            if isinstance(idx, slice) and dim < len(stride) and stride[dim]:
+                ind[i] = slice(idx.start, idx.stop, (idx.step or 1) * stride[dim])
+            dim += 1
+    return tuple(ind)
+
+
+def _memmap_dataset(dset, filename):
+    """
+    return a copy-on-write np.memmap of the h5py.Dataset dset in filename, or None if the data is not stored
+    contiguously in the file (chunked/compressed, compact, external or not yet allocated datasets)
+    """
+    if dset.dtype.hasobject or dset.size == 0:
+        return None
+    plist = dset.id.get_create_plist()
+    if plist.get_layout() != h5py.h5d.CONTIGUOUS or plist.get_external_count() > 0:
+        return None
+    offset = dset.id.get_offset()
+    if offset is None:
+        return None
+    return np.memmap(filename, mode='c', dtype=dset.dtype, shape=dset.shape, offset=offset, order='C')
+
+
+def read_h5(filename, path=None, axis_name="AXIS/AXIS", lazy=False, bound=None, stride=None, mmap=False, driver=None):
     """
     HDF reader for Osiris/Visxd compatible HDF files... This will slurp in the data
     and the attributes that describe the data (e.g. title, units, scale).
@@ -97,9 +314,29 @@ def read_h5(filename, path=None, axis_name="AXIS/AXIS"):
     We will convert all byte strings stored in the h5 file to strings which are easier to deal with when writing codes
     see also write_h5() function in this file
 
+    If lazy is True only the meta data is read and a LazyH5Data is returned. The data stays on disk until it is
+    indexed (lazy_data[:, 10], lazy_data.loc[...], lazy_data.sel(...)), reduced (lazy_data.sum(axis=0)) or loaded
+    (lazy_data.load()), and only the requested hyperslab is read from the file.
+
+    Use bound (and/or stride) to read a region of interest (and/or a downsampled grid) directly from the file:
+            read_h5('e1-000006.h5', bound={'x1': (10., 20.)}, stride=2)   # same as .sel(x1=(10., 20.)) but on disk
+            read_h5('e1-000006.h5', bound=(slice(None), 0.5))             # same as .loc[:, 0.5]
+    where bound follows the syntax of H5Data.sel (a dict) or H5Data.loc (a tuple), and stride is an int or a tuple
+    of int. They cannot be combined with lazy=True, use LazyH5Data.window() instead.
+
+    If mmap is True the data is memory mapped from the file instead of read (nothing is read until the data is
+    accessed and the OS page cache is shared between processes reading the same file). This only works for datasets
+    stored contiguously without compression, which is how OSIRIS writes grid data; other datasets are read as usual.
+    The mapping is copy-on-write, changing the data in memory never modifies the file. With bound/stride the
+    returned data is a view of the mapped dataset.
+
+    driver is passed to h5py.File, e.g. driver='core' reads the whole file into memory at once (see read_many).
+
     """
+    if lazy and (bound is not None or stride is not None):
+        raise ValueError('bound and stride cannot be used with lazy=True, use LazyH5Data.window() instead')
     fname = filename if not path else path + '/' + filename
-    data_file = h5py.File(fname, 'r')
+    data_file = h5py.File(fname, 'r', driver=driver)
 
     n_data = scan_hdf5_file_for_main_data_array(data_file)
 
@@ -171,8 +408,19 @@ def read_h5(filename, path=None, axis_name="AXIS/AXIS"):
         data_attrs['NAME'] = name
 
         # data_bundle.data = the_data_hdf_object[()]
-        data_bundle.append(H5Data(the_data_hdf_object, timestamp=timestamp,
-                                  data_attrs=data_attrs, run_attrs=run_attrs, axes=axes))
+        mm = _memmap_dataset(the_data_hdf_object, fname) if mmap and not lazy else None
+        if mm is not None:
+            d = H5Data(mm, timestamp=timestamp, data_attrs=data_attrs, run_attrs=run_attrs, axes=axes)
+            data_bundle.append(d if bound is None and stride is None else d[_bound_to_index(d, bound, stride)])
+        elif lazy or bound is not None or stride is not None:
+            lzd = LazyH5Data(os.path.abspath(fname), the_data_hdf_object.name, the_data_hdf_object.shape,
+                             the_data_hdf_object.dtype, timestamp=timestamp, data_attrs=data_attrs,
+                             run_attrs=run_attrs, axes=axes)
+            data_bundle.append(lzd if lazy else lzd.getitem(_bound_to_index(lzd, bound, stride),
+                                                            dset=the_data_hdf_object))
+        else:
+            data_bundle.append(H5Data(the_data_hdf_object, timestamp=timestamp,
+                                      data_attrs=data_attrs, run_attrs=run_attrs, axes=axes))
     data_file.close()
     if len(data_bundle) == 1:
         return data_bundle[0]
@@ -180,11 +428,227 @@ def read_h5(filename, path=None, axis_name="AXIS/AXIS"):
         return data_bundle
 
 
-def read_raw(filename, path=None):
+def _split_hyperslab_index(shape, index):
+    """
+    split a numpy basic index into an HDF5 hyperslab selection (h5py only accepts positive steps and no newaxis) and
+    the index that has to be applied to the array read from the file afterwards.
+    return None if index is not a basic index. Empty selections are not handled here.
+    """
+    if not isinstance(index, tuple):
+        index = (index,)
+    nell = sum(1 for idx in index if idx is Ellipsis)
+    nidx = sum(1 for idx in index if idx is not None and idx is not Ellipsis)
+    if nell > 1 or nidx > len(shape):
+        return None
+    h5sel, memsel, dim = [], [], 0
+    for idx in index:
+        if idx is Ellipsis:
+            for _ in range(len(shape) - nidx):
+                h5sel.append(slice(None))
+                memsel.append(slice(None))
+            dim += len(shape) - nidx
+        elif idx is None:
+            memsel.append(None)
+        elif isinstance(idx, slice):
+            r = range(*idx.indices(shape[dim]))
+            if r.step > 0:
+                h5sel.append(slice(r[0], r[-1] + 1, r.step))
+                memsel.append(slice(None))
+            else:  # read in increasing order then reverse in memory
+                h5sel.append(slice(r[-1], r[0] + 1, -r.step))
+                memsel.append(slice(None, None, -1))
+            dim += 1
+        elif isinstance(idx, (int, np.integer)):
+            i = int(idx) + shape[dim] if idx < 0 else int(idx)
+            if not 0 <= i < shape[dim]:
+                raise IndexError('index ' + str(idx) + ' is out of bounds for axis ' + str(dim) +
+                                 ' with size ' + str(shape[dim]))
+            h5sel.append(i)
+            dim += 1
+        else:  # advanced indexing
+            return None
+    h5sel.extend(slice(None) for _ in range(len(shape) - dim))
+    return tuple(h5sel), tuple(memsel)
+
+
+class LazyH5Data(object):
+    """
+    A read-only stand-in of H5Data whose data stays in the HDF5 file. See read_h5(..., lazy=True).
+    Indexing ([], .loc, .sel) reads only the corresponding hyperslab and returns H5Data (or numpy.ndarray for advanced
+    indexing, same as H5Data) with the axes updated the same way H5Data.__getitem__ does.
+    Reductions (sum, mean, min, max) are done slab by slab along the first axis so the whole array is never in memory.
+    load() (or numpy.asarray) reads everything.
+    """
+    # maximum size of a slab read at once by the reductions
+    block_bytes = 256 * 1024 ** 2
+
+    def __init__(self, filename, dataset, shape, dtype, timestamp=None, data_attrs=None, run_attrs=None, axes=None):
+        self.filename, self.dataset, self.shape, self.dtype = filename, dataset, tuple(shape), np.dtype(dtype)
+        self.timestamp = timestamp if timestamp else '0' * 6
+        self._data_attrs = cp.deepcopy(data_attrs) if data_attrs else {}
+        self._run_attrs = cp.deepcopy(run_attrs) if run_attrs else {}
+        self._axes = cp.deepcopy(axes) if axes else []
+
+    # reuse the meta data accessors and label based indexing of H5Data
+    name, label, units, loc = H5Data.name, H5Data.label, H5Data.units, H5Data.loc
+    index_of, has_axis, sel = H5Data.index_of, H5Data.has_axis, H5Data.sel
+    __str__ = H5Data.__str__
+
+    @property
+    def data_attrs(self):
+        return self._data_attrs
+
+    @property
+    def run_attrs(self):
+        return self._run_attrs
+
+    @property
+    def axes(self):
+        return self._axes
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def nbytes(self):
+        return self.size * self.dtype.itemsize
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __repr__(self):
+        return ''.join([str(self.__class__.__module__), '.', str(self.__class__.__name__), ' at ', hex(id(self)),
+                        ', ', self.filename, ':', self.dataset, ', shape', str(self.shape), ',\naxis:\n  ',
+                        '\n  '.join([repr(ax) for ax in self._axes]) if len(self._axes) else 'None',
+                        '\ndata_attrs: ', repr(self._data_attrs), '\nrun_attrs:', repr(self._run_attrs)])
+
+    def _meta_template(self):
+        """an H5Data with our shape and meta data but no memory behind it (all strides are zero)"""
+        return H5Data(np.broadcast_to(np.zeros((), dtype=self.dtype), self.shape), timestamp=self.timestamp,
+                      data_attrs=self._data_attrs, run_attrs=self._run_attrs, axes=self._axes)
+
+    def _read(self, dset, index):
+        """read dset[index] from the file as numpy.ndarray (or scalar)"""
+        sel = _split_hyperslab_index(self.shape, index)
+        if sel is None:  # advanced indexing, let numpy do the work
+            return dset[()][index]
+        return dset[sel[0]][sel[1]]
+
+    def __getitem__(self, index):
+        return self.getitem(index)
+
+    def getitem(self, index, dset=None):
+        """same as self[index], reading from dset if it is an already opened h5py.Dataset of self"""
+        meta = self._meta_template()[index]
+        if isinstance(meta, np.ndarray) and meta.size == 0:
+            v = np.empty(meta.shape, dtype=self.dtype)
+        elif dset is not None:
+            v = self._read(dset, index)
+        else:
+            with h5py.File(self.filename, 'r') as f:
+                v = self._read(f[self.dataset], index)
+        if isinstance(meta, H5Data):
+            return H5Data(v, timestamp=meta.timestamp, data_attrs=meta._data_attrs, run_attrs=meta._run_attrs,
+                          axes=meta._axes)
+        return v
+
+    def load(self):
+        """read the whole array into memory, return H5Data"""
+        return self[...]
+
+    def window(self, bound=None, stride=None):
+        """
+        read a region of interest, optionally downsampled, return H5Data
+        :param bound: a dict of {axis_name: bound} as in H5Data.sel or an index in axis units as in H5Data.loc
+        :param stride: int or tuple of int (one for each axis), read every stride-th point
+        """
+        return self[_bound_to_index(self, bound, stride)]
+
+    def header(self, bound=None, stride=None):
+        """
+        an H5Data with the shape and meta data of window(bound, stride) but nothing read from the file (all elements
+        point to the same zero), useful for allocating the output before reading
+        """
+        return self._meta_template()[_bound_to_index(self, bound, stride)]
+
+    def read_into(self, out, bound=None, stride=None):
+        """
+        same as window(bound, stride) but the data is written into out, an existing array of the right shape (for
+        example a slice of a bigger array). HDF5 reads directly into out if it is C-contiguous.
+        """
+        if out.size == 0:
+            return
+        index = _bound_to_index(self, bound, stride)
+        sel = _split_hyperslab_index(self.shape, index)
+        with h5py.File(self.filename, 'r') as f:
+            dset = f[self.dataset]
+            if sel is not None and all(m == slice(None) for m in sel[1]) and out.flags.c_contiguous:
+                dset.read_direct(out, source_sel=sel[0])
+            else:
+                out[...] = self._read(dset, index)
+
+    @property
+    def values(self):
+        return self.load().values
+
+    def __array__(self, dtype=None, copy=None):
+        v = self.load().view(np.ndarray)
+        return v if dtype is None else v.astype(dtype)
+
+    def __reduce_by_slab(self, ufunc, axis, dtype=None):
+        if isinstance(axis, str) or (isinstance(axis, (tuple, list)) and axis and isinstance(axis[0], str)):
+            axis = self.index_of(axis)
+        if axis is None:
+            axis = tuple(range(self.ndim))
+        elif isinstance(axis, (int, np.integer)):
+            axis = (axis,)
+        axis = tuple(sorted(a + self.ndim if a < 0 else a for a in axis))
+        if not self.ndim:
+            return ufunc.reduce(self.load().view(np.ndarray), axis=axis, dtype=dtype)
+        rows = max(1, self.block_bytes // max(1, self.nbytes // max(1, self.shape[0])))
+        acc, parts = None, []
+        with h5py.File(self.filename, 'r') as f:
+            dset = f[self.dataset]
+            for i0 in range(0, self.shape[0], rows):
+                part = ufunc.reduce(dset[i0:i0 + rows], axis=axis, dtype=dtype)
+                if 0 in axis:
+                    acc = part if acc is None else ufunc(acc, part)
+                else:
+                    parts.append(part)
+        if 0 not in axis:
+            acc = np.concatenate(parts)
+        if len(axis) == self.ndim:
+            return acc
+        return H5Data(acc, timestamp=self.timestamp, data_attrs=self._data_attrs, run_attrs=self._run_attrs,
+                      axes=[ax for i, ax in enumerate(self._axes) if i not in axis])
+
+    def sum(self, axis=None, dtype=None):
+        return self.__reduce_by_slab(np.add, axis, dtype=dtype)
+
+    def mean(self, axis=None, dtype=None):
+        s = self.__reduce_by_slab(np.add, axis, dtype=dtype)
+        n = self.size // max(1, int(np.prod(np.shape(s))))
+        return s / n
+
+    def min(self, axis=None):
+        return self.__reduce_by_slab(np.minimum, axis)
+
+    def max(self, axis=None):
+        return self.__reduce_by_slab(np.maximum, axis)
+
+
+def read_raw(filename, path=None, mmap=False):
     """
     Read particle raw data into a numpy sturctured array.
     See numpy documents for detailed usage examples of the structured array.
     The only modification is that the meta data of the particles are stored in .attrs attributes.
+    If mmap is True the quantities stored contiguously in the file are copied from a memory map of the file rather
+    than read through HDF5 (each quantity is a separate dataset so the structured array itself can't be mapped).
 
     Usage:
             part = read_raw("raw-electron-000000.h5")   # part is a subclass of numpy.ndarray with extra attributes
@@ -221,7 +685,8 @@ def read_raw(filename, path=None):
         dtype = [(q, data[q].dtype) for q in quants]
         r = PartData(data[dtype[0][0]].shape, dtype=dtype, attrs=d)
         for dt in dtype:
-            r[dt[0]] = data[dt[0]]
+            mm = _memmap_dataset(data[dt[0]], fname) if mmap else None
+            r[dt[0]] = data[dt[0]] if mm is None else mm
 
     return r
 
@@ -386,6 +851,158 @@ def scan_hdf5_file_for_main_data_array(h5file):
     return res
 
 
+def _first_value(v, cast):
+    try:
+        return cast(np.ravel(v)[0])
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def read_h5_header(filename):
+    """
+    read the meta data of an OSIRIS HDF5 file without touching the data, return a dict that can be saved as json:
+        {'name', 'datasets', 'timestamp', 'time', 'iter', 'shape', 'dtype', 'units', 'axes'}
+    where 'axes' is a list of [name, min, max, npoints, units]
+    """
+    d = read_h5(filename, lazy=True)
+    dl = d if isinstance(d, list) else [d]
+    d = dl[0]
+    return {'name': d.name, 'datasets': [di.dataset for di in dl], 'timestamp': d.timestamp,
+            'time': _first_value(d.run_attrs.get('TIME'), float), 'iter': _first_value(d.run_attrs.get('ITER'), int),
+            'shape': list(d.shape), 'dtype': d.dtype.str, 'units': str(d.units),
+            'axes': [[ax.name, float(ax.min), float(ax.max), int(ax.size), str(ax.units)] for ax in d.axes]}
+
+
+def _scan_one_header(filename):
+    try:
+        return read_h5_header(filename)
+    except Exception as err:  # we don't want one bad file to stop the scan
+        return {'error': repr(err)}
+
+
+class RunCatalog(object):
+    """
+    An index of the HDF5 files under an OSIRIS output directory (usually MS/) built from the file headers only.
+    The index is saved next to the data (rundir/.osh5catalog.json by default). Only new or modified files (judging by
+    mtime and size) are scanned again when the catalog is reopened.
+
+    Files are grouped by their directory relative to rundir (e.g. 'FLD/e1'), quantities can be referred to by the
+    relative directory or its last component ('e1') as long as it is unique. Usage:
+            cat = RunCatalog('./MS')               # scan using all CPUs, or load the index and update it
+            cat.quantities()                        # ['FLD/e1', 'FLD/e2', ...]
+            cat.files('e1', tmin=100, tmax=200)     # e1 files with 100 <= TIME <= 200, sorted by time
+            cat.nearest('e1', 150.)                 # e1 file closest to TIME=150
+            cat.header(cat.nearest('e1', 150.))     # shape, axes etc. of that file, see read_h5_header
+    """
+    index_name = '.osh5catalog.json'
+
+    def __init__(self, rundir, index=None, workers=None, update=True):
+        """
+        :param rundir: root directory to scan
+        :param index: file name of the index. default is rundir/.osh5catalog.json
+        :param workers: number of processes used to scan the files. default is os.cpu_count()
+        :param update: if False only load the saved index, do not look for changed files
+        """
+        self.rundir = os.path.abspath(rundir)
+        self.index = index if index else os.path.join(self.rundir, RunCatalog.index_name)
+        self.records, self.__lookup = {}, {}
+        try:
+            with open(self.index, 'r') as f:
+                self.records = json.load(f)
+        except (IOError, ValueError):  # no index or a broken one, start from scratch
+            pass
+        if update:
+            self.update(workers=workers)
+        else:
+            self.__build_lookup()
+
+    def update(self, workers=None):
+        """find new, modified and deleted files under rundir and update the index accordingly"""
+        found, todo = {}, []
+        for root, _, files in os.walk(self.rundir):
+            for fn in files:
+                if not fn.endswith('.h5'):
+                    continue
+                full = os.path.join(root, fn)
+                st = os.stat(full)
+                rel = os.path.relpath(full, self.rundir)
+                found[rel] = st.st_mtime, st.st_size
+                old = self.records.get(rel)
+                if not old or old['mtime'] != st.st_mtime or old['size'] != st.st_size:
+                    todo.append(rel)
+        changed = bool(todo) or len(found) != len(self.records) or any(k not in found for k in self.records)
+        self.records = {k: v for k, v in self.records.items() if k in found}
+        workers = workers if workers else os.cpu_count()
+        full = [os.path.join(self.rundir, rel) for rel in todo]
+        if workers > 1 and len(todo) > workers:
+            with ProcessPoolExecutor(workers) as pool:
+                headers = list(pool.map(_scan_one_header, full, chunksize=max(1, len(full) // (8 * workers))))
+        else:
+            headers = [_scan_one_header(fn) for fn in full]
+        for rel, hd in zip(todo, headers):
+            hd['mtime'], hd['size'] = found[rel]
+            self.records[rel] = hd
+        self.__build_lookup()
+        if changed:
+            self.save()
+
+    def save(self):
+        """write the index to disk atomically"""
+        tmp = self.index + '.tmp' + str(os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(self.records, f)
+        os.replace(tmp, self.index)
+
+    def __build_lookup(self):
+        # quantity -> (sorted times, file names in the same order)
+        lkp = {}
+        for rel, rec in self.records.items():
+            if 'error' in rec:
+                continue
+            t = rec['time'] if rec['time'] is not None else -float('inf')
+            lkp.setdefault(os.path.dirname(rel), []).append((t, rel))
+        self.__lookup = {}
+        for q, v in lkp.items():
+            v.sort()
+            self.__lookup[q] = [tf[0] for tf in v], [tf[1] for tf in v]
+
+    def quantities(self):
+        return sorted(self.__lookup)
+
+    def __find_quantity(self, quantity):
+        if quantity in self.__lookup:
+            return self.__lookup[quantity]
+        qs = [q for q in self.__lookup if os.path.basename(q) == quantity]
+        if len(qs) == 1:
+            return self.__lookup[qs[0]]
+        if not qs:
+            raise KeyError('quantity ' + quantity + ' not found in ' + self.rundir)
+        raise KeyError('quantity ' + quantity + ' is ambiguous, use one of ' + str(qs))
+
+    def times(self, quantity):
+        """TIME of all dumps of quantity in ascending order"""
+        return np.array(self.__find_quantity(quantity)[0])
+
+    def files(self, quantity, tmin=None, tmax=None):
+        """file names of quantity with tmin <= TIME <= tmax, in ascending order of TIME"""
+        times, fl = self.__find_quantity(quantity)
+        lo = 0 if tmin is None else bisect.bisect_left(times, tmin)
+        hi = len(times) if tmax is None else bisect.bisect_right(times, tmax)
+        return [os.path.join(self.rundir, f) for f in fl[lo:hi]]
+
+    def nearest(self, quantity, time):
+        """file name of the dump of quantity whose TIME is the closest to time"""
+        times, fl = self.__find_quantity(quantity)
+        i = bisect.bisect_left(times, time)
+        if i == len(times) or (i > 0 and time - times[i - 1] <= times[i] - time):
+            i -= 1
+        return os.path.join(self.rundir, fl[i])
+
+    def header(self, filename):
+        """the saved meta data of a file, see read_h5_header"""
+        return self.records[os.path.relpath(os.path.abspath(filename), self.rundir)]
+
+
 def write_h5(data, filename=None, path=None, dataset_name=None, overwrite=True, axis_name=None):
     """
     Usage:
@@ -424,6 +1041,17 @@ def write_h5(data, filename=None, path=None, dataset_name=None, overwrite=True,
         fname += current_name_attr + '-' + data_object.timestamp + '.h5'
     else:
         raise Exception("You did not specify a filename!!!")
+    fname = _prepare_output_file(fname, overwrite)
+    h5file = h5py.File(fname,'a')
+
+    # now put the data in a group called this...
+    h5dataset = h5file.create_dataset(current_name_attr, data_object.shape, data=data_object.view(np.ndarray))
+    _write_h5_meta(h5file, h5dataset, data_object, axis_name)
+    h5file.close()
+
+
+def _prepare_output_file(fname, overwrite):
+    """remove fname if overwrite is True, otherwise return a new name (fname.copyN.h5) if fname already exists"""
     if os.path.isfile(fname):
         if overwrite:
             os.remove(fname)
@@ -432,11 +1060,12 @@ def write_h5(data, filename=None, path=None, dataset_name=None, overwrite=True,
             while os.path.isfile(fname[:-3]+'.copy'+str(c)+'.h5'):
                 c += 1
             fname = fname[:-3]+'.copy'+str(c)+'.h5'
-    h5file = h5py.File(fname,'a')
-    run_attrs = data_object.run_attrs.copy()
+    return fname
 
-    # now put the data in a group called this...
-    h5dataset = h5file.create_dataset(current_name_attr, data_object.shape, data=data_object.view(np.ndarray))
+
+def _write_h5_meta(h5file, h5dataset, data_object, axis_name=None):
+    """write the meta data (run_attrs, data_attrs and axes) of H5Data data_object to h5file and its dataset h5dataset"""
+    run_attrs = data_object.run_attrs.copy()
 
     # these are required so we make defaults..
     h5file.attrs['ITER'] = [0]
@@ -500,7 +1129,114 @@ def write_h5(data, filename=None, path=None, dataset_name=None, overwrite=True,
 #                     axis_data.attrs['UNITS'] = np.array([b'a.u.'])
 #             else:
             axis_data.attrs[key] = np.array([value.encode('utf-8')]) if isinstance(value, (str, OSUnits)) else value
-    h5file.close()
+
+
+def _stream_chunks(shape, itemsize, max_bytes=1024**2, nframes=1):
+    """chunk shape of a stack of frames: nframes in time, split in space until one frame of a chunk is at most max_bytes"""
+    chunks = [1] + list(shape[1:])
+    while np.prod(chunks) * itemsize > max_bytes and max(chunks) > 1:
+        i = int(np.argmax(chunks))
+        chunks[i] = (chunks[i] + 1) // 2
+    chunks[0] = max(1, min(nframes, shape[0]))
+    return tuple(chunks)
+
+
+class H5StreamWriter(object):
+    """
+    Write a (large) dataset into an h5 file frame by frame along the first axis, so that only one frame has to be
+    in memory at a time. The meta data is written when the writer is closed. Usage:
+            with H5StreamWriter('e1-stack.h5', (nt, nx, ny), 'float64', dataset_name='e1', compression='gzip') as w:
+                for d in frames:
+                    w.append(d)
+                w.close(meta=stacked_h5data_header)   # H5Data (or a header, see LazyH5Data.header) describing the stack
+            stacked = read_h5('e1-stack.h5', lazy=True)
+    """
+    def __init__(self, filename, shape, dtype, dataset_name='Data', chunks=True, compression=None,
+                 compression_opts=None, overwrite=True, frames_per_chunk=1, resume=False):
+        """
+        :param filename: name of the output file
+        :param shape: shape of the whole dataset, the first dimension is the number of frames
+        :param dtype: data type of the dataset
+        :param dataset_name: name of the dataset
+        :param chunks: True for one-frame-in-time chunks of at most 1MB, a tuple for user defined chunks, or None for a
+                       contiguous dataset (compression needs chunks)
+        :param compression, compression_opts: passed to h5py create_dataset, e.g. compression='gzip'
+        :param overwrite: see write_h5
+        :param frames_per_chunk: number of frames in a chunk when chunks is True. more frames per chunk makes reading
+                                 the dataset along the first axis faster, use extend() to write whole chunks at once
+        :param resume: if True and filename already has the dataset (with the same shape and dtype), it is opened for
+                       writing instead of being recreated, frames already in the file are kept. see abort()
+        """
+        self.shape, self.dtype, self.n = tuple(shape), np.dtype(dtype), 0
+        if resume and os.path.isfile(filename):
+            self.filename = filename
+            self.h5file = h5py.File(self.filename, 'a')
+            self.h5dataset = self.h5file.get(dataset_name)
+            if self.h5dataset is None or self.h5dataset.shape != self.shape or self.h5dataset.dtype != self.dtype:
+                self.h5file.close()
+                raise ValueError('Cannot resume writing ' + filename + ': dataset ' + dataset_name +
+                                 ' is missing or has a different shape/dtype')
+            return
+        self.filename = _prepare_output_file(filename, overwrite)
+        if chunks is True:
+            chunks = _stream_chunks(self.shape, self.dtype.itemsize, nframes=frames_per_chunk)
+        self.h5file = h5py.File(self.filename, 'a')
+        self.h5dataset = self.h5file.create_dataset(dataset_name, self.shape, dtype=self.dtype, chunks=chunks,
+                                                    compression=compression, compression_opts=compression_opts)
+
+    def append(self, frame):
+        """write frame to the next slot along the first axis"""
+        if self.n >= self.shape[0]:
+            raise IndexError('Writing frame ' + str(self.n) + ' into a dataset of ' + str(self.shape[0]) + ' frames')
+        self.write(self.n, frame)
+        self.n += 1
+
+    def extend(self, frames):
+        """write a block of frames (stacked along the first axis) starting from the next slot"""
+        n = len(frames)
+        if self.n + n > self.shape[0]:
+            raise IndexError('Writing frame ' + str(self.n + n - 1) + ' into a dataset of ' + str(self.shape[0]) +
+                             ' frames')
+        self.write_block(self.n, frames)
+        self.n += n
+
+    def write(self, i, frame):
+        """write frame to slot i along the first axis"""
+        self.h5dataset[i] = np.asarray(frame)
+
+    def write_block(self, i, frames):
+        """write a block of frames (stacked along the first axis) to slots i, i+1, ..."""
+        frames = np.asarray(frames)
+        self.h5dataset[i:i + len(frames)] = frames
+
+    def flush(self):
+        """make sure what has been written so far is on disk"""
+        self.h5file.flush()
+
+    def abort(self):
+        """close the file without writing the meta data, writing can be resumed later with resume=True"""
+        if self.h5file:
+            self.h5file.close()
+            self.h5file = None
+
+    def close(self, meta=None):
+        """
+        write the meta data and close the file
+        :param meta: H5Data whose data_attrs, run_attrs and axes describe the whole dataset. nothing but the defaults
+                     is written if meta is None
+        """
+        if self.h5file:
+            if meta is None:
+                meta = H5Data(np.broadcast_to(np.zeros((), dtype=self.dtype), self.shape))
+            _write_h5_meta(self.h5file, self.h5dataset, meta)
+            self.h5file.close()
+            self.h5file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
 
 
 def write_h5_openpmd(data, filename=None, path=None, dataset_name=None, overwrite=True, axis_name=None,
@@ -8,23 +8,72 @@ import osh5def
 import numpy as np
 import copy
 import re
+import pickle
 from functools import wraps, partial, reduce
 import warnings
 import osh5io
 import glob
+import os
+import h5py
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from scipy import signal
 from scipy import ndimage
+import scipy.fft as scipy_fft
 # use pyFFTW for fft if available
 try:
+    import pyfftw
     import pyfftw.interfaces.numpy_fft as fftmod
     import pyfftw.interfaces.cache as fftcache
 except ImportError:
+    pyfftw = None
     import numpy.fft as fftmod
 # import numpy.fft as fftmod
-from multiprocessing import Pool
 
 
 utils_cache = {}
+# floating point precision of the FFT wrappers, filters, field_decompose and monogenic_signal, see set_precision()
+precision_config = {'precision': 'auto'}
+
+
+def set_precision(precision):
+    """
+    set the default precision of the FFT wrappers, field_decompose, monogenic_signal and the filters
+    :param precision: 'auto': arrays we create (wavenumber grids, filters) follow the precision of the data, so float32
+                              data stays float32/complex64 and float64 data stays float64/complex128
+                      'single': everything is computed in float32/complex64, halving the memory of float64 data
+                      'double': everything is computed in float64/complex128
+                      most of these functions also take a per call precision keyword
+    """
+    if precision not in ('auto', 'single', 'double'):
+        raise ValueError("precision must be 'auto', 'single' or 'double'")
+    precision_config['precision'] = precision
+
+
+def _float_type(data, precision=None):
+    """the real float type used for computations on data under the precision policy"""
+    p = precision if precision else precision_config['precision']
+    if p == 'single':
+        return np.float32
+    if p == 'double':
+        return np.float64
+    if p != 'auto':
+        raise ValueError("precision must be 'auto', 'single' or 'double'")
+    dt = np.result_type(data)
+    return np.float32 if dt == np.float32 or dt == np.complex64 else np.float64
+
+
+def _cast_precision(a, precision=None):
+    """cast a to the precision policy ('auto' leaves a alone), complex data stays complex"""
+    p = precision if precision else precision_config['precision']
+    if p == 'auto':
+        return a
+    ft = _float_type(a, p)
+    dt = np.result_type(ft, np.complex64) if np.iscomplexobj(a) else ft
+    if np.result_type(a) == dt:
+        return a
+    return a.astype(dt) if isinstance(a, np.ndarray) else np.asarray(a).astype(dt)  # H5Data keeps its metadata
+
 
 def metasl(func=None, axes=None, unit=None):
     """save meta data before calling the function and restore them to output afterwards
@@ -43,7 +92,8 @@ def metasl(func=None, axes=None, unit=None):
         # load saved meta data into specified positions
         try:
             if isinstance(out, osh5def.H5Data):
-                out.__dict__.update(saved)
+                for k, v in saved.items():
+                    setattr(out, k, v)
             else:
                 out = osh5def.H5Data(out, **saved)
         except:
@@ -164,25 +214,57 @@ def stack(arr, axis=0, axesdata=None):
             raise TypeError('Input be list of H5Data or filenames of Osiris data (such as "./FLD/e1/*.h5")')
     except (TypeError, IndexError):   # not an array or an empty array, just return what ever passed in
         return arr
-    md = arr[-1]
-    ax = copy.deepcopy(md.axes)
+    r = np.stack(arr, axis=axis)
+    return __stacked_h5data(r, arr[-1], arr[0].run_attrs['TIME'], axis=axis, axesdata=axesdata)
+
+
+def __stacked_h5data(r, md, tfirst, axis=0, axesdata=None):
+    """wrap the stacked array r into H5Data using meta data of md (the last frame), tfirst is TIME of the first frame"""
+    ax = list(md.axes)
     if axesdata:
-        if axesdata.size != len(arr):
+        if axesdata.size != r.shape[axis]:
             raise ValueError('Number of points in axesdata is different from the new dimension to be created')
         ax.insert(axis, axesdata)
     else:  # we assume the new dimension is time
         taxis_attrs = {'UNITS': "\omega_p^{-1}", 'LONG_NAME': "time", 'NAME': "t"}
-        ax.insert(axis, osh5def.DataAxis(float(arr[0].run_attrs['TIME']),
-                                         float(arr[-1].run_attrs['TIME']), len(arr), attrs=taxis_attrs))
-    r = np.stack(arr, axis=axis)
+        ax.insert(axis, osh5def.DataAxis(float(np.ravel(tfirst)[0]), float(np.ravel(md.run_attrs['TIME'])[0]),
+                                         r.shape[axis], attrs=taxis_attrs))
     return osh5def.H5Data(r, md.timestamp, md.data_attrs, md.run_attrs, axes=ax)
 
 
-def read_and_ndarray(f):
-    return osh5io.read_grid(f).view(np.ndarray)
+def __file_list(dir_or_filelist, prefix=None, file_slice=slice(None,)):
+    prfx = str(prefix).strip() if prefix else ''
+
+    if isinstance(dir_or_filelist, str):
+        return sorted(glob.glob(dir_or_filelist + '/' + prfx + '*.*'))[file_slice]
+    else:  # dir_or_filelist is a list of file names
+        return dir_or_filelist[file_slice]
+
 
+def _read_and_preprocess(fn, func_list, bound=None, stride=None):
+    return reduce(lambda x, y: y[0](x, *y[1], **y[2]), func_list, osh5io.read_grid(fn, bound=bound, stride=stride))
+
+
+def __processed_frames(flist, func_list, cpu_count=1, bound=None, stride=None):
+    """read (a region of) each file and apply the preprocess functions, yield the frames in order"""
+    if func_list and cpu_count > 1:
+        try:
+            pickle.dumps(func_list)
+        except (pickle.PicklingError, AttributeError, TypeError):
+            warnings.warn('preprocess functions cannot be sent to other processes (lambda or local functions?), '
+                          'they will run in the main process')
+        else:
+            # reading and preprocessing both happen in the workers, only the (usually much smaller) results come back
+            yield from osh5io.map_files(partial(_read_and_preprocess, func_list=func_list, bound=bound, stride=stride),
+                                        flist, workers=cpu_count, processes=True)
+            return
+    frames = osh5io.read_many(flist, workers=cpu_count, processes=cpu_count > 1, bound=bound, stride=stride)
+    for d in frames:
+        yield reduce(lambda x, y: y[0](x, *y[1], **y[2]), func_list, d)
 
-def combine(dir_or_filelist, prefix=None, file_slice=slice(None,), preprocess=None, axesdata=None, save=None, cpu_count=1):
+
+def combine(dir_or_filelist, prefix=None, file_slice=slice(None,), preprocess=None, axesdata=None, save=None, cpu_count=1,
+            bound=None, stride=None, stream=False, chunks=True, compression=None):
     """
     stack a directory of grid data and optionally save the result to a file
     :param dir_or_filelist: name of the directory
@@ -196,6 +278,12 @@ def combine(dir_or_filelist, prefix=None, file_slice=slice(None,), preprocess=No
     :param axesdata: user difined axes, see stack for more detail
     :param save: name of the save file. user can also set it to true value and the output will use write_h5 defaults
     :param cpu_count: Number of CPU's to spread job over for parallel computation
+    :param bound: only read this region of each file, in axis units. see osh5io.read_h5 for the syntax
+    :param stride: only read every stride-th grid point of each file, int or tuple of int. see osh5io.read_h5
+    :param stream: write each frame into the save file as soon as it is read (and preprocessed) instead of stacking
+                    them in memory first. only one frame is in memory at a time. the file is returned as
+                    osh5io.LazyH5Data, use .load() to read it all
+    :param chunks, compression: HDF5 storage of the save file in stream mode, see osh5io.H5StreamWriter
     :return: combined grid data, one dimension more than the preprocessed original data
     Usage of preprocess:
     The functino list should look like:
@@ -207,34 +295,61 @@ def combine(dir_or_filelist, prefix=None, file_slice=slice(None,), preprocess=No
         if preprocess=[(numpy.power, 2), (numpy.average, {'axis':0}), numpy.sqrt], then the data to be stacked is
         numpy.sqrt( numpy.average( numpy.power( read_grid(file_name), 2 ), axis=0 ) )
     """
-    prfx = str(prefix).strip() if prefix else ''
-
-    if isinstance(dir_or_filelist, str):
-        flist = sorted(glob.glob(dir_or_filelist + '/' + prfx + '*.*'))[file_slice]
-    else:  # dir_or_filelist is a list of file names
-        flist = dir_or_filelist[file_slice]
-    if isinstance(preprocess, list) and preprocess:
-        func_list = [__parse_func_param(item) for item in preprocess]
-        tmp = [reduce(lambda x, y: y[0](x, *y[1], **y[2]), func_list, osh5io.read_grid(fn)).view(np.ndarray) for fn in flist[1:-1]]
-        # the first and last file should be H5data
-        tmp.insert(0, reduce(lambda x, y: y[0](x, *y[1], **y[2]), func_list, osh5io.read_grid(flist[0])))
-        tmp.append(reduce(lambda x, y: y[0](x, *y[1], **y[2]), func_list, osh5io.read_grid(flist[-1])))
+    flist = __file_list(dir_or_filelist, prefix, file_slice)
+    func_list = [__parse_func_param(item) for item in preprocess] if isinstance(preprocess, list) else []
+    if save and not isinstance(save, str) and isinstance(dir_or_filelist, str):
+        save = dir_or_filelist
+    if stream:
+        return __stream_combine(flist, func_list, save, axesdata, cpu_count, bound, stride, chunks, compression)
+    # the output is allocated once and each frame goes directly into its slice
+    if not func_list and all(str(fn).endswith('.h5') for fn in flist):
+        hdr = [osh5io.read_h5(fn, lazy=True) for fn in (flist[0], flist[-1])]
     else:
-        if cpu_count>1:
-            tmp = Pool(cpu_count).map( read_and_ndarray, [f for f in flist[1:-1]] )
-        else:
-            tmp = [osh5io.read_grid(f).view(np.ndarray) for f in flist[1:-1]]
-        # the first and last file should be H5data
-        tmp.insert(0, osh5io.read_grid(flist[0]))
-        tmp.append(osh5io.read_grid(flist[-1]))
-    res = stack(tmp, axis=0, axesdata=axesdata)
+        hdr = None
+    if hdr and all(isinstance(h, osh5io.LazyH5Data) for h in hdr):
+        # only the headers of the first and last file are needed, the data is read straight into the output
+        md, tfirst = hdr[-1].header(bound=bound, stride=stride), hdr[0].run_attrs['TIME']
+        r = np.empty((len(flist),) + md.shape, dtype=md.dtype)
+
+        def read_frame(i):
+            hd = hdr[-1] if i == len(flist) - 1 else osh5io.read_h5(flist[i], lazy=True)
+            hd.read_into(r[i], bound=bound, stride=stride)
+
+        with ThreadPoolExecutor(max(cpu_count, 1)) as pool:
+            list(pool.map(read_frame, range(len(flist))))
+    else:
+        # files are read ahead in the background while the previous ones are processed
+        r, md, tfirst = None, None, None
+        for i, d in enumerate(__processed_frames(flist, func_list, cpu_count, bound, stride)):
+            if r is None:
+                r, tfirst = np.empty((len(flist),) + np.shape(d), dtype=np.result_type(d)), d.run_attrs['TIME']
+            elif not np.can_cast(np.result_type(d), r.dtype):
+                r = r.astype(np.result_type(r, d))
+            r[i], md = d, d
+    res = __stacked_h5data(r, md, tfirst, axis=0, axesdata=axesdata)
     if save:
-        if not isinstance(save, str):
-            save = dir_or_filelist if isinstance(dir_or_filelist, str) else './' + res.name + '.h5'
-        osh5io.write_h5(res, save)
+        osh5io.write_h5(res, save if isinstance(save, str) else './' + res.name + '.h5')
     return res
 
 
+def __stream_combine(flist, func_list, save, axesdata, cpu_count, bound, stride, chunks, compression):
+    w, md, tfirst = None, None, None
+    try:
+        for d in __processed_frames(flist, func_list, cpu_count, bound, stride):
+            if w is None:
+                save = save if isinstance(save, str) else './' + d.name + '.h5'
+                w = osh5io.H5StreamWriter(save, (len(flist),) + np.shape(d), np.result_type(d),
+                                          dataset_name=d.name, chunks=chunks, compression=compression)
+                tfirst = d.run_attrs['TIME']
+            w.append(d)
+            md = d
+        md = __stacked_h5data(np.broadcast_to(np.zeros((), dtype=w.dtype), w.shape), md, tfirst, axesdata=axesdata)
+    finally:
+        if w is not None:
+            w.close(meta=md if md is not None and md.ndim == len(w.shape) else None)
+    return osh5io.read_h5(w.filename, lazy=True)
+
+
 def __parse_func_param(item):
     """
     The limitation here is that
@@ -283,6 +398,78 @@ def argmaxloc(data, axis=None, out=None):
 # #----------------------------------- FFT Wrappers ----------------------------------------
 # sfunc: for shifting; ffunc: for calculating frequency; ftfunc: for fft the data; uafunc: for updating axes
 #
+# the FFT engine used by all the wrappers below, change it with set_fft_backend()
+fft_config = {'backend': 'pyfftw' if pyfftw else 'scipy', 'threads': 1, 'fast_size': False,
+              'planner_effort': 'FFTW_MEASURE', 'keepalive': 300.}
+
+
+def set_fft_backend(backend=None, threads=None, fast_size=None, planner_effort=None, keepalive=None):
+    """
+    configure the FFT wrappers of this module (fftn, rfftn, ifft2 ...), parameters that are None are not changed.
+    pyfftw plans are cached between calls so repeated transforms of the same shape (e.g. one per time step) are
+    planned only once, see also save_fft_wisdom/load_fft_wisdom.
+    :param backend: 'pyfftw', 'scipy' (scipy.fft) or 'numpy' (numpy.fft)
+    :param threads: number of threads used by each transform (numpy.fft is always single threaded).
+                    can also be set per call, e.g. fftn(data, threads=8)
+    :param fast_size: if True forward transforms zero-pad the data to the next fast length (see
+                      scipy.fft.next_fast_len) unless the output size is given. can also be set per call,
+                      e.g. rfftn(data, fast_size=True)
+    :param planner_effort: pyfftw planner effort, 'FFTW_ESTIMATE', 'FFTW_MEASURE', 'FFTW_PATIENT' or 'FFTW_EXHAUSTIVE'
+    :param keepalive: seconds an unused pyfftw plan is kept in the cache
+    :return: dict of the current settings
+    """
+    if backend is not None:
+        if backend not in ('pyfftw', 'scipy', 'numpy'):
+            raise ValueError('Unknown FFT backend ' + str(backend) + ", use 'pyfftw', 'scipy' or 'numpy'")
+        if backend == 'pyfftw' and pyfftw is None:
+            raise ImportError('pyfftw is not installed')
+        fft_config['backend'] = backend
+    for k, v in (('threads', threads), ('fast_size', fast_size), ('planner_effort', planner_effort),
+                 ('keepalive', keepalive)):
+        if v is not None:
+            fft_config[k] = v
+    if fft_config['backend'] == 'pyfftw':
+        fftcache.enable()
+        fftcache.set_keepalive_time(fft_config['keepalive'])
+    return dict(fft_config)
+
+
+def save_fft_wisdom(filename):
+    """save the pyfftw wisdom (the plans found so far) to file, return False if pyfftw is not available"""
+    if pyfftw is None:
+        return False
+    with open(filename, 'wb') as f:
+        pickle.dump(pyfftw.export_wisdom(), f)
+    return True
+
+
+def load_fft_wisdom(filename):
+    """load pyfftw wisdom saved by save_fft_wisdom so that the plans don't have to be measured again"""
+    if pyfftw is None:
+        return False
+    with open(filename, 'rb') as f:
+        return all(pyfftw.import_wisdom(pickle.load(f)))
+
+
+def _fft_engine(name):
+    """the FFT routine 'name' (fftn, rfft etc.) of the current backend, called with the configured threads"""
+    def ft(a, s=None, axes=None, norm=None, threads=None, precision=None, **kwargs):
+        threads = threads if threads else fft_config['threads']
+        a = _cast_precision(a, precision)
+        if fft_config['backend'] == 'pyfftw':
+            kwargs.setdefault('planner_effort', fft_config['planner_effort'])
+            # aligned input allows SIMD plans, byte_align only copies if needed
+            return getattr(fftmod, name)(pyfftw.byte_align(np.asarray(a)), s, axes, norm, threads=threads, **kwargs)
+        if fft_config['backend'] == 'scipy':
+            return getattr(scipy_fft, name)(a, s, axes, norm, workers=threads, **kwargs)
+        return getattr(np.fft, name)(a, s, axes, norm, **kwargs)
+    ft.__name__ = name
+    return ft
+
+
+set_fft_backend()
+
+
 def __idle(a, *_args, **_kwargs):
     return a
 
@@ -316,20 +503,41 @@ def __update_axes_label(axes, i):
         pass
 
 
+# the axes of (inverse) FFT are uniform so they are given as (increment, npoints, offset, origin) of
+# DataAxis.from_increment instead of arrays, the zero frequency is then exactly 0
+def _fft_axis(n, d=1.0):
+    """same as fftshift(fftfreq(n, d)) * 2 * pi"""
+    return 2 * np.pi / (n * d), n, -(n // 2), 0.
+
+
+def _rfft_axis(n, d=1.0):
+    """same as rfftfreq(n, d) * 2 * pi"""
+    return 2 * np.pi / (n * d), n // 2 + 1, 0, 0.
+
+
+def _ifft_axis(n, d=1.0, min=0.0):
+    return 2 * np.pi / d / n, n, 0, min
+
+
+def _ihfft_axis(n, d=1.0, min=0.0):
+    return 2 * np.pi / d / n, n // 2 + 1, 0, min
+
+
+def __set_uniform_axis(axes, i, spec):
+    axes[i] = osh5def.DataAxis.from_increment(*spec, attrs=axes[i].attrs)
+
+
 @__try_update_axes
 def _update_fft_axes(axes, idx, shape, omitlast, ffunc):
     for i in idx[:-1]:
         __update_axes_label(axes, i)
         axes[i].attrs['shift'] = axes[i].min  # save lower bound. value of axes
-        axes[i].ax = fftmod.fftshift(fftmod.fftfreq(shape[i], d=axes[i].increment)) * 2 * np.pi
+        __set_uniform_axis(axes, i, _fft_axis(shape[i], d=axes[i].increment))
     # the last dimension needs special care for rfft
     i = idx[-1]
     __update_axes_label(axes, i)
     axes[i].attrs['shift'] = axes[i].min  # save lower bound. value of axes
-    if omitlast:
-        axes[i].ax = ffunc(shape[i], d=axes[i].increment) * 2 * np.pi
-    else:
-        axes[i].ax = fftmod.fftshift(ffunc(shape[i], d=axes[i].increment)) * 2 * np.pi
+    __set_uniform_axis(axes, i, ffunc(shape[i], d=axes[i].increment))
 
 
 @__try_update_axes
@@ -345,7 +553,7 @@ def _update_ifft_axes(axes, idx, shape, _unused, ffunc):
                               'Make sure to use our FFT routine for forward FFT',
                               RuntimeWarning)
                 warned = True
-        axes[i].ax = ffunc(shape[i], d=axes[i].increment, min=xmin)
+        __set_uniform_axis(axes, i, ffunc(shape[i], d=axes[i].increment, min=xmin))
         try:
             if axes[i].attrs['LONG_NAME'] == '\omega' or axes[i].attrs['UNITS'].is_frequency():
                 axes[i].attrs['LONG_NAME'], axes[i].attrs['NAME'] = 'time', 't'
@@ -357,16 +565,6 @@ def _update_ifft_axes(axes, idx, shape, _unused, ffunc):
             pass
 
 
-def _get_ihfft_axis(n, d=1.0, min=0.0):
-    length = 2 * np.pi / d
-    return np.arange(min, length + min, length / n)[0: n//2+1]
-
-
-def _get_ifft_axis(n, d=1.0, min=0.0):
-    length = 2 * np.pi / d
-    return np.arange(min, length + min, length / n)
-
-
 def __ft_interface(ftfunc, forward, omitlast):
     @metasl
     def ft_interface(a, s, axes, norm, **kwargs):
@@ -381,66 +579,100 @@ def __ft_interface(ftfunc, forward, omitlast):
         else:
             shftax = axes
         if forward:
-            return fftmod.fftshift(ftfunc(a, s, axes, norm, **kwargs), shftax)
+            return np.fft.fftshift(ftfunc(a, s, axes, norm, **kwargs), shftax)
         else:
-            return ftfunc(fftmod.ifftshift(a, shftax), s, axes, norm, **kwargs)
+            return ftfunc(np.fft.ifftshift(a, shftax), s, axes, norm, **kwargs)
     return ft_interface
 
 
+def __full_shape(shape, s, axes):
+    """expand s (the sizes along axes, as in numpy.fft) to the sizes along every dimension"""
+    shape = list(shape)
+    s = (s,) if isinstance(s, (int, np.integer)) else s
+    if axes is None:
+        axes = range(len(shape) - len(s), len(shape))
+    elif isinstance(axes, (int, np.integer)):
+        axes = (axes,)
+    for i, n in zip(axes, s):
+        shape[i] = n
+    return tuple(shape)
+
+
 def __shifted_ft_gen(ftfunc, forward, omitlast, ffunc, uafunc):
     def shifted_fft(a, s=None, axes=None, norm=None, **kwargs):
-        shape = s if s is not None else (a.data_attrs['oshape'] if omitlast else a.shape)
+        if s is None:
+            shape = a.data_attrs['oshape'] if omitlast else a.shape
+        else:
+            shape = __full_shape(a.shape, s, axes)
         o = __ft_interface(ftfunc, forward=forward, omitlast=omitlast)(a, s=s, axes=axes, norm=norm, **kwargs)
         uafunc(o, axes, shape, omitlast, ffunc=ffunc)
         return o
     return shifted_fft
 
 
+def __fast_shape(a, s, axes, kwargs, real=False):
+    """the padded size s of forward FFT if fast_size is on (see set_fft_backend)"""
+    fast = kwargs.pop('fast_size', None)
+    if s is not None or not (fft_config['fast_size'] if fast is None else fast):
+        return s
+    if isinstance(axes, int):
+        return scipy_fft.next_fast_len(a.shape[axes], real=real)
+    axes = range(a.ndim) if axes is None else axes
+    return tuple(scipy_fft.next_fast_len(a.shape[i], real=real) for i in axes)
+
+
 # # ========  Normal FFT  ==========
-__shifted_fft = partial(__shifted_ft_gen, forward=True, omitlast=False, ffunc=fftmod.fftfreq, uafunc=_update_fft_axes)
-__shifted_ifft = partial(__shifted_ft_gen, forward=False, omitlast=False, ffunc=_get_ifft_axis, uafunc=_update_ifft_axes)
+__shifted_fft = partial(__shifted_ft_gen, forward=True, omitlast=False, ffunc=_fft_axis, uafunc=_update_fft_axes)
+__shifted_ifft = partial(__shifted_ft_gen, forward=False, omitlast=False, ffunc=_ifft_axis, uafunc=_update_ifft_axes)
 
 
 @enhence_num_indexing_kw('axes')
 def fftn(a, s=None, axes=None, norm=None, **kwargs):
-    return __shifted_fft(fftmod.fftn)(a, s=s, axes=axes, norm=norm, **kwargs)
+    s = __fast_shape(a, s, axes, kwargs)
+    return __shifted_fft(_fft_engine('fftn'))(a, s=s, axes=axes, norm=norm, **kwargs)
 
 
 @enhence_num_indexing_kw('axes')
 def fft2(a, s=None, axes=(-2, -1), norm=None, **kwargs):
-    return __shifted_fft(fftmod.fft2)(a, s=s, axes=axes, norm=norm, **kwargs)
+    s = __fast_shape(a, s, axes, kwargs)
+    return __shifted_fft(_fft_engine('fft2'))(a, s=s, axes=axes, norm=norm, **kwargs)
 
 
 @enhence_num_indexing_kw('axis')
 def fft(a, n=None, axis=-1, norm=None, **kwargs):
-    return __shifted_fft(fftmod.fft)(a, s=n, axes=axis, norm=norm, **kwargs)
+    n = __fast_shape(a, n, axis, kwargs)
+    return __shifted_fft(_fft_engine('fft'))(a, s=n, axes=axis, norm=norm, **kwargs)
 
 
 @enhence_num_indexing_kw('axes')
 def ifftn(a, s=None, axes=None, norm=None, **kwargs):
-    return __shifted_ifft(fftmod.ifftn)(a, s=s, axes=axes, norm=norm, **kwargs)
+    return __shifted_ifft(_fft_engine('ifftn'))(a, s=s, axes=axes, norm=norm, **kwargs)
 
 
 @enhence_num_indexing_kw('axes')
 def ifft2(a, s=None, axes=(-2, -1), norm=None, **kwargs):
-    return __shifted_ifft(fftmod.ifft2)(a, s=s, axes=axes, norm=norm, **kwargs)
+    return __shifted_ifft(_fft_engine('ifft2'))(a, s=s, axes=axes, norm=norm, **kwargs)
 
 
 @enhence_num_indexing_kw('axis')
 def ifft(a, n=None, axis=-1, norm=None, **kwargs):
     # if axes is None:
     #     axes = -1
-    return __shifted_ifft(fftmod.ifft)(a, s=n, axes=axis, norm=norm, **kwargs)
+    return __shifted_ifft(_fft_engine('ifft'))(a, s=n, axes=axis, norm=norm, **kwargs)
 
 
 # # ========  real FFT  ==========
-__shifted_rfft = partial(__shifted_ft_gen, forward=True, omitlast=True, ffunc=fftmod.rfftfreq, uafunc=_update_fft_axes)
-__shifted_irfft = partial(__shifted_ft_gen, forward=False, omitlast=True, ffunc=_get_ifft_axis, uafunc=_update_ifft_axes)
+__shifted_rfft = partial(__shifted_ft_gen, forward=True, omitlast=True, ffunc=_rfft_axis, uafunc=_update_fft_axes)
+__shifted_irfft = partial(__shifted_ft_gen, forward=False, omitlast=True, ffunc=_ifft_axis, uafunc=_update_ifft_axes)
 
 
-def __save_space_shape(a, s):
+def __save_space_shape(a, s, axis=-1):
     if isinstance(a, osh5def.H5Data):
         shape = s if s is not None else a.shape
+        if isinstance(shape, (int, np.integer)):  # 1D transform, n is only the size along axis
+            shape = list(a.shape)
+            shape[axis] = s
+            shape = tuple(shape)
         a.data_attrs.setdefault('oshape', shape)
 
 
@@ -470,43 +702,46 @@ def __rss_nd(a, _s, axes):
 
 @enhence_num_indexing_kw('axes')
 def rfftn(a, s=None, axes=None, norm=None, **kwargs):
+    s = __fast_shape(a, s, axes, kwargs, real=True)
     __save_space_shape(a, s)
-    return __shifted_rfft(fftmod.rfftn)(a, s=s, axes=axes, norm=norm, **kwargs)
+    return __shifted_rfft(_fft_engine('rfftn'))(a, s=s, axes=axes, norm=norm, **kwargs)
 
 
 @enhence_num_indexing_kw('axes')
 def rfft2(a, s=None, axes=(-2, -1), norm=None, **kwargs):
+    s = __fast_shape(a, s, axes, kwargs, real=True)
     __save_space_shape(a, s)
-    return __shifted_rfft(fftmod.rfft2)(a, s=s, axes=axes, norm=norm, **kwargs)
+    return __shifted_rfft(_fft_engine('rfft2'))(a, s=s, axes=axes, norm=norm, **kwargs)
 
 
 @enhence_num_indexing_kw('axis')
 def rfft(a, n=None, axis=-1, norm=None, **kwargs):
-    __save_space_shape(a, n)
-    return __shifted_rfft(fftmod.rfft)(a, s=n, axes=axis, norm=norm, **kwargs)
+    n = __fast_shape(a, n, axis, kwargs, real=True)
+    __save_space_shape(a, n, -1 if axis is None else axis)
+    return __shifted_rfft(_fft_engine('rfft'))(a, s=n, axes=axis, norm=norm, **kwargs)
 
 
 @enhence_num_indexing_kw('axes')
 def irfftn(a, s=None, axes=None, norm=None, **kwargs):
     s = __rss_nd(a, s, axes)
-    return __shifted_irfft(fftmod.irfftn)(a, s=s, axes=axes, norm=norm, **kwargs)
+    return __shifted_irfft(_fft_engine('irfftn'))(a, s=s, axes=axes, norm=norm, **kwargs)
 
 
 @enhence_num_indexing_kw('axes')
 def irfft2(a, s=None, axes=(-2, -1), norm=None, **kwargs):
     s = __rss_2d(a, s, axes)
-    return __shifted_irfft(fftmod.irfft2)(a, s=s, axes=axes, norm=norm, **kwargs)
+    return __shifted_irfft(_fft_engine('irfft2'))(a, s=s, axes=axes, norm=norm, **kwargs)
 
 
 @enhence_num_indexing_kw('axis')
 def irfft(a, n=None, axis=-1, norm=None, **kwargs):
     n = __rss_1d(a, n, axis)
-    return __shifted_irfft(fftmod.irfft)(a, s=n, axes=axis, norm=norm, **kwargs)
+    return __shifted_irfft(_fft_engine('irfft'))(a, s=n, axes=axis, norm=norm, **kwargs)
 
 
 # # ========  Hermitian FFT  ==========
-__shifted_hfft = partial(__shifted_ft_gen, forward=True, omitlast=False, ffunc=fftmod.fftfreq, uafunc=_update_fft_axes)
-__shifted_ihfft = partial(__shifted_ft_gen, forward=False, omitlast=False, ffunc=_get_ihfft_axis, uafunc=_update_ifft_axes)
+__shifted_hfft = partial(__shifted_ft_gen, forward=True, omitlast=False, ffunc=_fft_axis, uafunc=_update_fft_axes)
+__shifted_ihfft = partial(__shifted_ft_gen, forward=False, omitlast=False, ffunc=_ihfft_axis, uafunc=_update_ifft_axes)
 
 
 @enhence_num_indexing_kw('axis')
@@ -514,12 +749,100 @@ def hfft(a, n=None, axis=-1, norm=None, **kwargs):
     if n is None:
         n = a.shape[-1] if axis is None else a.shape[axis]
     nn = 2*n - 1 if n % 2 else 2*n - 2
-    return __shifted_hfft(fftmod.hfft)(a, s=nn, axes=axis, norm=norm, **kwargs)
+    return __shifted_hfft(_fft_engine('hfft'))(a, s=nn, axes=axis, norm=norm, **kwargs)
 
 
 @enhence_num_indexing_kw('axis')
 def ihfft(a, n=None, axis=-1, norm=None, **kwargs):
-    return __shifted_ihfft(fftmod.ihfft)(a, s=n, axes=axis, norm=norm, **kwargs)
+    return __shifted_ihfft(_fft_engine('ihfft'))(a, s=n, axes=axis, norm=norm, **kwargs)
+
+
+def dispersion(dir_or_filelist, prefix=None, file_slice=slice(None,), preprocess=None, bound=None, stride=None,
+               window=None, detrend=None, finalize=np.abs, precision=None, block_bytes=256 * 1024**2, tmpdir=None,
+               cpu_count=1):
+    """
+    omega-k spectrum (dispersion diagram) of a time series of grid data, same as finalize(fftn(combine(...))) but the
+    space-time data is never in memory: frames are streamed into a temporary HDF5 file in blocks of time, transformed
+    along time block by block in space (into a second temporary file), then along space block by block in frequency.
+    Only the output after finalize is kept in memory.
+    :param dir_or_filelist, prefix, file_slice, preprocess, bound, stride, cpu_count: see combine
+    :param window: window applied along time before the transform, anything scipy.signal.get_window accepts
+                   (e.g. 'hann', ('tukey', 0.2)) or an array of length nt
+    :param detrend: 'constant' or 'linear', remove the mean or the linear trend along time at each grid point
+    :param finalize: applied to each block of the spectrum before it is stored, default is np.abs. None keeps the
+                     complex spectrum
+    :param precision: see set_precision
+    :param block_bytes: approximate size of the data blocks in memory
+    :param tmpdir: directory of the temporary files, default is the system temporary directory
+    :return: H5Data with (omega, k...) axes, in the same layout as fftn
+    """
+    flist = __file_list(dir_or_filelist, prefix, file_slice)
+    if not flist:
+        raise ValueError('no file to read in ' + str(dir_or_filelist) + ' (prefix=' + str(prefix) + ', file_slice=' +
+                         str(file_slice) + ')')
+    func_list = [__parse_func_param(item) for item in preprocess] if isinstance(preprocess, list) else []
+    nt, w, md, tfirst = len(flist), None, None, None
+    tmpfiles = []
+    for _ in range(2):
+        fd, fn = tempfile.mkstemp(suffix='.h5', dir=tmpdir)
+        os.close(fd)
+        tmpfiles.append(fn)
+    try:
+        # 1. stack the frames on disk, a block of ct frames at a time so that each chunk is written once
+        for d in __processed_frames(flist, func_list, cpu_count, bound, stride):
+            if w is None:
+                dt = _float_type(d, precision)
+                dt = np.result_type(dt, np.complex64) if np.iscomplexobj(d) else np.dtype(dt)
+                ct = int(max(1, min(nt, block_bytes // max(1, d.size * dt.itemsize))))
+                w = osh5io.H5StreamWriter(tmpfiles[0], (nt,) + d.shape, dt, dataset_name=d.name, frames_per_chunk=ct)
+                buf, nb, tfirst = np.empty((ct,) + d.shape, dtype=dt), 0, d.run_attrs['TIME']
+            buf[nb], md = d, d
+            nb += 1
+            if nb == len(buf):
+                w.extend(buf)
+                nb = 0
+        if nb:
+            w.extend(buf[:nb])
+        del buf
+        w.close()
+        meta = __stacked_h5data(np.broadcast_to(np.zeros((), dtype=w.dtype), w.shape), md, tfirst)
+        _update_fft_axes(meta, None, meta.shape, False, ffunc=_fft_axis)
+        ctype = np.result_type(_float_type(w.dtype, precision), np.complex64)
+        space = w.shape[1:]
+        sax = tuple(range(1, len(w.shape)))
+        if window is not None:
+            win = window if isinstance(window, np.ndarray) else signal.get_window(window, nt)
+            win = np.asarray(win, dtype=_float_type(w.dtype, precision)).reshape((nt,) + (1,) * len(space))
+        with h5py.File(tmpfiles[0], 'r') as fr, h5py.File(tmpfiles[1], 'w') as fs:
+            src = fr[md.name]
+            dst = fs.create_dataset('spectrum', src.shape, dtype=ctype, chunks=True)
+            # 2. FFT along time, block by block along the first spatial axis (all time steps of a block in memory)
+            step = max(1, block_bytes // (nt * int(np.prod(space[1:])) * ctype.itemsize))
+            step = max(src.chunks[1], step - step % src.chunks[1])
+            for lo in range(0, space[0], step):
+                blk = src[:, lo:lo + step]
+                if detrend:
+                    blk = signal.detrend(blk, axis=0, type=detrend)
+                if window is not None:
+                    blk = blk * win
+                dst[:, lo:lo + step] = np.fft.fftshift(_fft_engine('fft')(blk, None, 0, None, precision=precision),
+                                                       axes=0)
+            # 3. FFT along space, block by block in frequency
+            step, out = max(1, block_bytes // (int(np.prod(space)) * ctype.itemsize)), None
+            for lo in range(0, nt, step):
+                blk = np.fft.fftshift(_fft_engine('fftn')(dst[lo:lo + step], None, sax, None, precision=precision),
+                                      axes=sax)
+                if finalize:
+                    blk = finalize(blk)
+                if out is None:
+                    out = np.empty(src.shape, dtype=blk.dtype)
+                out[lo:lo + step] = blk
+    finally:
+        if w is not None:
+            w.close()
+        for fn in tmpfiles:
+            os.remove(fn)
+    return osh5def.H5Data(out, meta.timestamp, meta.data_attrs, meta.run_attrs, axes=meta.axes)
 # ----------------------------------- FFT Wrappers ----------------------------------------
 
 
@@ -592,7 +915,8 @@ def moveaxis(a, source, destination):
     return _move(a)
 # ---------------------------------- NumPy Wrappers ---------------------------------------
 
-def field_decompose(fldarr, ffted=True, idim=None, finalize=None, outquants=('L', 't'), norft=False, iftf=ifftn, inplace=False, **additional_fft_kwargs):
+def field_decompose(fldarr, ffted=True, idim=None, finalize=None, outquants=('L', 't'), norft=False, iftf=ifftn, inplace=False,
+                    precision=None, slabs=1, slab_axis=None, **additional_fft_kwargs):
     """decompose a vector field into transverse and longitudinal direction
     fldarr: list of field components in the order of x, y, z (x1, x2, x3)
     ffted: If the input fields have been Fourier transformed
@@ -607,6 +931,11 @@ def field_decompose(fldarr, ffted=True, idim=None, finalize=None, outquants=('L'
     norft: if set to true then use full fft instead of rfft (only relevant when the field data is of real numbers)
     iftf: the inverse fft method used if idim is not None. Only used when ffted=True
     inplace: perform field decomposition inplace, setting this to True will change fldarr
+    precision: 'auto', 'single' or 'double', see set_precision. default is the global setting
+    slabs: do the decomposition (and the inverse transform) in this many slabs along slab_axis to limit the memory
+        used by temporary arrays. only works with idim. the input can also be a list of osh5io.LazyH5Data (ffted=True)
+        in which case each slab is read from the files when needed
+    slab_axis: the axis to split, must not be in idim. default is the first axis not in idim
     return: list of field components in the following order (if some are not requested they will be simply omitted):
         ['L', 'T', 't', 'l']
     """
@@ -617,8 +946,11 @@ def field_decompose(fldarr, ffted=True, idim=None, finalize=None, outquants=('L'
         return copy.deepcopy(fldarr)
     if not finalize:
         finalize = __idle
+    # only our own fft wrappers know about precision, a user supplied iftf gets additional_fft_kwargs as they are
+    own_iftf = iftf in (fftn, ifftn, rfftn, irfftn)
     if np.issubdtype(fldarr[0].dtype, np.floating):
         ftf, iftf = (fftn, (lambda *args, **kwargs: np.real(ifftn(*args, **kwargs)))) if norft else (rfftn, irfftn)
+        own_iftf = True
     if idim:
         if isinstance(idim, int):
             idim = [idim]
@@ -629,9 +961,12 @@ def field_decompose(fldarr, ffted=True, idim=None, finalize=None, outquants=('L'
         if ftaxes is None:
             ftaxes = [i for i in range(fldarr[0].ndim)]
 
+    fft_kwargs = dict(additional_fft_kwargs, precision=precision)
+    ifft_kwargs = fft_kwargs if own_iftf else additional_fft_kwargs
+
     def wrap_up(data):
         if idim:
-            return iftf(data, axes=idim, **additional_fft_kwargs)
+            return iftf(data, axes=idim, **ifft_kwargs)
         else:
             return data
 
@@ -644,50 +979,137 @@ def field_decompose(fldarr, ffted=True, idim=None, finalize=None, outquants=('L'
         return fld
 
     if ffted:
-        if inplace:
-            fftfld = fldarr
-        else:
-            fftfld = [copy.deepcopy(fi) for fi in fldarr]
+        # the input is never modified so there is no need to copy it
+        fftfld = fldarr
     else:
         if inplace:
             for i, fi in enumerate(fldarr):
-                fldarr[i] = ftf(fi, axes=ftaxes, **additional_fft_kwargs)
+                fldarr[i] = ftf(fi, axes=ftaxes, **fft_kwargs)
             fftfld = fldarr
         else:
-            fftfld = [ftf(fi, axes=ftaxes, **additional_fft_kwargs) for fi in fldarr]
-    kv = np.meshgrid(*reversed([x.ax for x in fftfld[0].axes]), sparse=True)
+            fftfld = [ftf(fi, axes=ftaxes, **fft_kwargs) for fi in fldarr]
+
+    if slabs > 1:
+        if not idim:
+            raise ValueError('slabs only works with idim (the decomposition is done along the axes not in idim)')
+        nd = fftfld[0].ndim
+        slab_axis = [i for i in range(nd) if i not in [j % nd for j in idim]][0] if slab_axis is None else slab_axis % nd
+        if slab_axis in [j % nd for j in idim]:
+            raise ValueError('slab_axis cannot be one of the axes in idim')
+        edges = np.linspace(0, fftfld[0].shape[slab_axis], slabs + 1).astype(int)
+        # the wave numbers come from the whole axes, a slab may be too thin to tell where k = 0 is
+        kv, out = __wave_numbers(fftfld[0], _float_type(fftfld[0], precision)), None
+        for lo, hi in zip(edges[:-1], edges[1:]):
+            if lo == hi:
+                continue
+            idx = (slice(None),) * slab_axis + (slice(lo, hi),)
+            part = __field_decompose_kernel([_cast_precision(fi[idx], precision) for fi in fftfld], outquants,
+                                            wrap_up, finalize, precision, bool(idim),
+                                            [k[idx] if k.shape[slab_axis] > 1 else k for k in kv])
+            if out is None:
+                out = []
+                for r, nm, ln in part:
+                    shape = list(r.shape)
+                    shape[slab_axis] = fftfld[0].shape[slab_axis]
+                    out.append((np.empty(shape, dtype=r.dtype), r, nm, ln))
+            for (o, _, _, _), (r, _, _) in zip(out, part):
+                o[idx] = r
+        res = []
+        for o, r, nm, ln in out:
+            if isinstance(r, osh5def.H5Data):
+                axes = list(r.axes)
+                axes[slab_axis] = fftfld[0].axes[slab_axis]
+                o = osh5def.H5Data(o, timestamp=r.timestamp, data_attrs=r.data_attrs, run_attrs=r.run_attrs, axes=axes)
+            res.append(rename(o, nm, ln))
+        return tuple(res)
+
+    res = __field_decompose_kernel([_cast_precision(fi, precision) for fi in fftfld], outquants, wrap_up, finalize,
+                                   precision, bool(idim))
+    return tuple(rename(r, nm, ln) for r, nm, ln in res)
+
+
+def __abs2_add(acc, x):
+    """acc + |x|^2 with a single temporary array (acc is modified if given)"""
+    a = np.abs(x)
+    a *= a
+    if acc is None:
+        return a
+    acc += a
+    return acc
+
+
+def __wave_numbers(fld, fdt):
+    """
+    wave numbers of the Fourier transformed H5Data fld, one array per component broadcastable to fld. k_i (of x_i)
+    varies along axis ndim-i. k = 0 is found relative to the grid spacing, so that round off in the axis (e.g. of a
+    rebuilt or sliced axis) does not hide it
+    """
+    nd, kv = fld.ndim, []
+    for i in range(nd):
+        shape = [1] * nd
+        shape[nd - 1 - i] = -1
+        ax = fld.axes[nd - 1 - i]
+        k = np.where(np.abs(ax.ax) < 0.5 * abs(ax.increment), 0., ax.ax)
+        kv.append(np.asarray(k, dtype=fdt).reshape(shape))
+    return kv
+
+
+def __field_decompose_kernel(fftfld, outquants, wrap_up, finalize, precision=None, inverse=False, kv=None):
+    """
+    the longitudinal/transverse decomposition of Fourier transformed vector field fftfld, see field_decompose.
+    kv: wave numbers (see __wave_numbers), default is to take them from the axes of fftfld[0]
+    return a list of (data, name, long name) in the order of L, T, t1, t2, ..., l1, l2, ...
+    """
+    nd, fdt = fftfld[0].ndim, _float_type(fftfld[0], precision)
+    if kv is None:
+        kv = __wave_numbers(fftfld[0], fdt)
     k2 = sum(ki**2 for ki in kv)  # |k|^2
     k2[k2 == 0.0] = float('inf')
-    kdotfld = np.divide(sum(np.multiply(fi, ki) for ki, fi in zip(kv, fftfld)), k2)
-    fL, fT, ft, fl = 0, 0, [], []
+    kdotfld = fftfld[0] * kv[0]
+    for fi, ki in zip(fftfld[1:], kv[1:]):
+        kdotfld += fi * ki
+    fL, fT, ft, fl = None, None, [], []
+    if 'L' in outquants and not inverse and not ('l' in outquants or any('l' + str(i + 1) in outquants for i in range(nd))):
+        # sum_i |k_i (k.E) / k^2|^2 = |k.E|^2 / k^2, no need to build the longitudinal components
+        fL = __abs2_add(None, kdotfld)
+        fL /= k2
+        lquants = ()
+    else:
+        lquants = outquants
+    kdotfld /= k2
+    del k2
     for i, fi in enumerate(fftfld):
+        want_t, want_l = 't' in outquants or 't' + str(i + 1) in outquants, 'l' in lquants or 'l' + str(i + 1) in lquants
+        need_t, need_l = want_t or 'T' in outquants, want_l or 'L' in lquants
+        if not (need_t or need_l):
+            continue
         tmp = kdotfld * kv[i]
-        if 't' in outquants or 't' + str(i + 1) in outquants:
-            ft.append((finalize(wrap_up(fftfld[i] - tmp)), 't' + str(i + 1)))
+        if need_l:
+            li = wrap_up(tmp)
+            if want_l:
+                fl.append((finalize(li), 'l' + str(i + 1)))
+                li = fl[-1][0]
+            if 'L' in lquants:
+                fL = __abs2_add(fL, li)
+            del li
+        if need_t:
+            ti = np.subtract(fi, tmp, out=tmp) if not need_l else fi - tmp
+            ti = wrap_up(ti)
+            if want_t:
+                ft.append((finalize(ti), 't' + str(i + 1)))
+                ti = ft[-1][0]
             if 'T' in outquants:
-                fT += np.abs(ft[-1][0])**2
-        elif 'T' in outquants:
-            fT += np.abs(wrap_up(fftfld[i] - tmp))**2
-
-        if 'l' in outquants or 'l'+str(i+1) in outquants:
-            fl.append((finalize(wrap_up(tmp)), 'l'+str(i+1)))
-            if 'L' in outquants:
-                fL += np.abs(fl[-1][0])**2
-        elif 'L' in outquants:
-            fL += np.abs(wrap_up(tmp))**2
-
+                fT = __abs2_add(fT, ti)
+            del ti
+        del tmp
     res = []
-    if not isinstance(fL, int):
-        res.append(rename(fL, 'L', 'L^2'))
-    if not isinstance(fT, int):
-        res.append(rename(fT, 'T', 'T^2'))
-    if ft:
-        for fi in ft:
-            res.append(rename(fi[0], fi[1], '{' + fi[1] + '}'))
-    if fl:
-        for fi in fl:
-            res.append(rename(fi[0], fi[1], '{' + fi[1] + '}'))
-    return tuple(res)
+    if fL is not None:
+        res.append((fL, 'L', 'L^2'))
+    if fT is not None:
+        res.append((fT, 'T', 'T^2'))
+    res.extend((f, n, '{' + n + '}') for f, n in ft)
+    res.extend((f, n, '{' + n + '}') for f, n in fl)
+    return res
 
 
 # modified from SciPy cookbook
@@ -707,9 +1129,7 @@ def rebin(a, fac, method='sum'):
     a = a[index]
     # update axes first
     if isinstance(a, osh5def.H5Data):
-        ax = copy.deepcopy(a.axes)
-        for i, x in enumerate(ax):
-            x.ax = x.ax[::fac[i]]
+        ax = [x.subaxis(slice(None, None, fac[i])) for i, x in enumerate(a.axes)]
     else:
         ax = None
     mthd = 'mean' if method.lower() == 'mean' else 'sum'
@@ -809,7 +1229,8 @@ def log_Gabor_Filter_2d(w, w0, s0):
     w0: the position of the peak
     s0: the value of abs(s0-1) determines the width of the peak.
     """
-    return np.exp( - np.log(w/w0)**2 / (2 * np.log(s0)**2) )
+    # python float so that single precision w is not promoted
+    return np.exp( - np.log(w/w0)**2 / (2 * float(np.log(s0))**2) )
 
 
 def retangular_Bandpass_Filter(k, center, hwidth):
@@ -819,13 +1240,14 @@ def retangular_Bandpass_Filter(k, center, hwidth):
     center: center of the bandpass filter
     hwidth: half width of the bandpass filter
     """
-    r = np.ones(k.shape)
+    r = np.ones(k.shape, dtype=k.dtype if np.issubdtype(k.dtype, np.floating) else float)
     r[k<center-hwidth] = 0
     r[k>center+hwidth] = 0
     return r
 
 
-def monogenic_signal(data, *args, filter_func=log_Gabor_Filter_2d, ffted=True, ifft=True, caching=False, **additional_fft_kwargs):
+def monogenic_signal(data, *args, filter_func=log_Gabor_Filter_2d, ffted=True, ifft=True, caching=False, precision=None,
+                     **additional_fft_kwargs):
     """
     Get the monogenic signal of 2D data. This implementation is better suited for intrisically 1D signals.
     read the following articles for more details:
@@ -836,16 +1258,18 @@ def monogenic_signal(data, *args, filter_func=log_Gabor_Filter_2d, ffted=True, i
     :param filter_func: filter function
     :param ffted: Set to True if the ft_data is the Fourier transform, default is False
     :param ifft: if True then inverse Fourier transform back to real space, default is True
+    :param precision: 'auto', 'single' or 'double', see set_precision. default is the global setting
     :return: mongenic signal as a tuple (f, f_R), where f is the filtered orginal signal and f_R is the
              Riesz transform of the filtered signal
     """
     if data.ndim != 2:
         raise ValueError('data must be two dimensional')
-    ft_data = fft2(data) if not ffted else data
+    ft_data = fft2(data, precision=precision) if not ffted else _cast_precision(data, precision)
+    fdt = _float_type(ft_data, precision)
 
     def get_k_k2(_ft_data):
-        w = np.meshgrid(*reversed([x.ax for x in _ft_data.axes]), sparse=True)
-        wamp = np.sqrt(np.sum(wi**2 for wi in w))
+        w = [wi.astype(fdt) for wi in np.meshgrid(*reversed([x.ax for x in _ft_data.axes]), sparse=True)]
+        wamp = np.sqrt(sum(wi**2 for wi in w))
         origin = np.where(wamp==0)
         wamp[origin] = 1.
         flt = filter_func(wamp, *args)
@@ -855,7 +1279,7 @@ def monogenic_signal(data, *args, filter_func=log_Gabor_Filter_2d, ffted=True, i
 
     if caching:
         k = ('monogenic_signal', ft_data.axes[0].ax[0], ft_data.axes[0].ax[-1], ft_data.axes[0].ax.size,
-             ft_data.axes[1].ax[0], ft_data.axes[1].ax[-1], ft_data.axes[1].ax.size, args)
+             ft_data.axes[1].ax[0], ft_data.axes[1].ax[-1], ft_data.axes[1].ax.size, args, fdt)
         wamp, flt = utils_cache.get(k, (None, None))
         if wamp is None:
             wamp, flt = get_k_k2(ft_data)
@@ -866,8 +1290,8 @@ def monogenic_signal(data, *args, filter_func=log_Gabor_Filter_2d, ffted=True, i
     ge = flt * ft_data
     goc = ge * wamp
     if ifft:
-        goc = ifft2(goc, **additional_fft_kwargs)
-        ge = np.real(ifft2(ge, **additional_fft_kwargs))
+        goc = ifft2(goc, precision=precision, **additional_fft_kwargs)
+        ge = np.real(ifft2(ge, precision=precision, **additional_fft_kwargs))
     return ge, goc
 
 
@@ -1041,6 +1465,30 @@ def lineout(h5data, point, slope, variable='x1', linewidth=0, extent_fill=None,
     return r
 
 
+def _test_field_decompose_slabs():
+    """decomposing slab by slab agrees with decomposing the whole 3D field at once"""
+    axes = [osh5def.DataAxis(0., n, n, attrs={'NAME': 'x' + str(3 - i)}) for i, n in enumerate((6, 8, 10))]
+    fld = [fftn(osh5def.H5Data(np.random.rand(6, 8, 10), axes=axes)) for _ in range(3)]
+    for idim in (1, 2):
+        whole = field_decompose(fld, idim=idim, outquants=('L', 'l3', 't3'))
+        for slabs in (2, 3, 5):
+            for a, b in zip(field_decompose(fld, idim=idim, outquants=('L', 'l3', 't3'), slabs=slabs), whole):
+                assert np.allclose(a, b), 'field_decompose with slabs=%d differs from slabs=1' % slabs
+
+
+def _test_fft_axes_odd_sizes():
+    """the zero frequency of FFT axes is exactly 0 for odd sizes too, so monogenic_signal removes the DC term"""
+    for n in (3, 5, 11, 33):
+        for length in (1., 3.7, 2 * np.pi, 123.4):
+            h = osh5def.H5Data(np.zeros((n, 4)), axes=[osh5def.DataAxis(0., length, n), osh5def.DataAxis(0., 1., 4)])
+            k = fftn(h).axes[0].ax
+            assert k[n // 2] == 0., 'k = %r instead of 0 (n=%d, L=%g)' % (k[n // 2], n, length)
+            assert np.allclose(k, np.fft.fftshift(np.fft.fftfreq(n, length / n)) * 2 * np.pi)
+    h = osh5def.H5Data(np.random.rand(5, 11), axes=[osh5def.DataAxis(0., 3.7, 5), osh5def.DataAxis(0., 3.7, 11)])
+    ge, _ = monogenic_signal(fft2(h), 0., 0.5, filter_func=retangular_Bandpass_Filter, ifft=False)
+    assert ge[2, 5] == 0.
+
+
 if __name__ == '__main__':
     fn = 'n0-123456.h5'
     d = osh5io.read_h5(fn)
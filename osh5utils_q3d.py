@@ -19,6 +19,13 @@
 
 
 
+import os
+import json
+import hashlib
+from collections import deque, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from scipy import interpolate
 import osh5io
 import osh5def
 import osh5vis
@@ -41,7 +48,7 @@ def filename_re(rundir,plasma_field,mode,fileno):
     return(plasma_field_path)
 
 def filename_im(rundir,plasma_field,mode,fileno):
-    plasma_field_path=rundir+'/MS/FLD/MODE-{mode:1d}-RE/{plasma_field:s}_cyl_m/{plasma_field:s}_cyl_m-{mode:1d}-re-{fileno:06d}.h5'.format(plasma_field=plasma_field,mode=mode,fileno=fileno)
+    plasma_field_path=rundir+'/MS/FLD/MODE-{mode:1d}-IM/{plasma_field:s}_cyl_m/{plasma_field:s}_cyl_m-{mode:1d}-im-{fileno:06d}.h5'.format(plasma_field=plasma_field,mode=mode,fileno=fileno)
     # print(plasma_field_path)
     return(plasma_field_path)
 
@@ -58,131 +65,454 @@ def filename_3d(rundir,plasma_field,fileno):
 # ******************************************************************************************************
 
 
-def q3d_to_3d(rundir,plasma_field,fileno,mode_max,x1_min,x1_max,nx1,x2_min,x2_max,nx2,x3_min,x3_max,nx3):
-    from scipy import interpolate
-    dx1=(x1_max-x1_min)/(nx1-1)
-    dx2=(x2_max-x2_min)/(nx2-1)
-    dx3=(x3_max-x3_min)/(nx3-1)
+# the transverse components of vector fields are stored as (r, theta) components in the mode files
+transverse_pair = {'e2': 'e3', 'e3': 'e2', 'b2': 'b3', 'b3': 'b2', 'j2': 'j3', 'j3': 'j2'}
+
+
+def sample_points(x_min,x_max,nx):
+    """coordinates where the 3d field is evaluated, both ends included"""
+    return np.linspace(x_min,x_max,nx)
+
+
+def sample_axis(x_min,x_max,nx,attrs):
+    """DataAxis of sample_points(x_min,x_max,nx). the max of a DataAxis is one grid spacing past its last point"""
+    return osh5def.DataAxis(x_min,x_min+(x_max-x_min)*nx/(nx-1) if nx>1 else x_max,nx,attrs=attrs)
 
-    x1_axis=np.arange(x1_min,x1_max+dx1,dx1)
-    x2_axis=np.arange(x2_min,x2_max+dx2,dx2)
-    x3_axis=np.arange(x3_min,x3_max+dx3,dx3)
-    
-    a = np.zeros((nx1,nx2,nx3),dtype=float)
-    
-    filename_out = filename_3d(rundir,plasma_field,fileno)
 
+def cartesian_axes(x1_min,x1_max,nx1,x2_min,x2_max,nx2,x3_min,x3_max,nx3):
+    x1 = sample_axis(x1_min,x1_max, nx1, attrs={'NAME':'x1', 'LONG_NAME':'x_1', 'UNITS':'c / \\omega_0'})
+    x2 = sample_axis(x2_min,x2_max, nx2, attrs={'NAME':'x2', 'LONG_NAME':'x_2', 'UNITS':'c / \\omega_0'})
+    x3 = sample_axis(x3_min,x3_max, nx3, attrs={'NAME':'x3', 'LONG_NAME':'x_3', 'UNITS':'c / \\omega_0'})
+    return [x1, x2, x3]
 
 
-    x1 = osh5def.DataAxis(x1_min,x1_max, nx1, attrs={'NAME':'x1', 'LONG_NAME':'x_1', 'UNITS':'c / \omega_0'})
-    x2 = osh5def.DataAxis(x2_min,x2_max, nx2, attrs={'NAME':'x2', 'LONG_NAME':'x_2', 'UNITS':'c / \omega_0'})
-    x3 = osh5def.DataAxis(x3_min,x3_max, nx3, attrs={'NAME':'x3', 'LONG_NAME':'x_3', 'UNITS':'c / \omega_0'})
-
-
-
-    # More attributes associated with the data/simulation. Again no need to worry about the details.
-    data_attrs = {'UNITS': osh5def.OSUnits('m_e c \omega_0 / e'), 'NAME': plasma_field, 'LONG_NAME': plasma_field}
-    run_attrs = {'NOTE': 'parameters about this simulation are stored here', 'TIME UNITS': '1/\omega_0',
-            'XMAX':np.array([1., 15.]), 'XMIN':np.array([0., 10.])}
-
-
-
-    # Now "wrap" the numpy array into osh5def.H5Data. Note that the data and the axes are consistent and are in fortran ordering
-    b = osh5def.H5Data(a, timestamp='123456', data_attrs=data_attrs, run_attrs=run_attrs, axes=[x1, x2, x3])
-    
-
-    
-    # I am doing mode 0 outside of the loop
-    
-    fname_re=filename_re(rundir,plasma_field,0,fileno)
-    # DEBUG
-    print(fname_re)
-    # DEBUG
-    data_re = osh5io.read_h5(fname_re)
-    print(data_re.shape)
-    print(data_re.axes[1].ax.shape)
-    print(data_re.axes[0].ax.shape)
-    
-    func_re = interpolate.interp2d(data_re.axes[1].ax,data_re.axes[0].ax,data_re,kind='cubic')
-    
-    for i1 in range(0,nx1):
-        for i2 in range(0,nx2):
-            for i3 in range(0,nx3):
-                z = x1_axis[i1]
-                x = x3_axis[i3]
-                y = x2_axis[i2]
-                
-                r = np.sqrt(x*x+y*y)
-                # if r != 0:
-                #     cos_th = x/r
-                #     sin_th = y/r
-                # else:
-                #     cos_th = 1
-                #     sin_th = 0
-                a[i1,i2,i3]=a[i1,i2,i3]+func_re(z,r)
-                
+def read_modes(rundir,plasma_field,fileno,mode_max):
+    """
+    read the mode files of plasma_field at one time step
+    :return: (mode 0 H5Data, list of 2D (r, z) arrays [re0, re1, im1, re2, im2, ...])
+    """
+    data_0=osh5io.read_h5(filename_re(rundir,plasma_field,0,fileno))
+    modes=[data_0.view(np.ndarray)]
     for i_mode in range(1,mode_max+1):
-        fname_re=filename_re(rundir,plasma_field,i_mode,fileno)
-        fname_im=filename_im(rundir,plasma_field,i_mode,fileno)
-
-        # DEBUG
-        print(fname_re)
-        # DEBUG
-        if(plasma_field =='e2' or plasma_field == 'e3'):
-            if (plasma_field == 'e2'):
-                field_comp = 'e3'
-            else:
-                field_comp = 'e2'
-              
-            data_re_self=osh5io.read_h5(filename_re(rundir,plasma_field,i_mode,fileno))
-            data_im_self=osh5io.read_h5(filename_im(rundir,plasma_field,i_mode,fileno))
-            
-            data_re_comp=osh5io.read_h5(filename_re(rundir,field_comp,i_mode,fileno))
-            data_im_comp=osh5io.read_h5(filename_im(rundir,field_comp,i_mode,fileno))
-            
+        modes.append(osh5io.read_h5(filename_re(rundir,plasma_field,i_mode,fileno)).view(np.ndarray))
+        modes.append(osh5io.read_h5(filename_im(rundir,plasma_field,i_mode,fileno)).view(np.ndarray))
+    return data_0, modes
+
+
+def mode_harmonics(theta,mode_max):
+    """
+    weights of each mode array: a(theta) = re0 + sum_m re_m * cos(m theta) - im_m * sin(m theta)
+    :return: array of shape (2*mode_max+1,) + theta.shape, in the same order as read_modes
+    """
+    harm=np.empty((2*mode_max+1,)+np.shape(theta))
+    harm[0]=1
+    for i_mode in range(1,mode_max+1):
+        harm[2*i_mode-1]=np.cos(i_mode*theta)
+        harm[2*i_mode]=-np.sin(i_mode*theta)
+    return harm
+
+
+def polar_coordinates(x2_axis,x3_axis):
+    """r and theta of the (x2, x3) plane, x = x3 and y = x2. theta is 0 on the axis"""
+    y,x=np.meshgrid(x2_axis,x3_axis,indexing='ij')
+    r=np.sqrt(x*x+y*y)
+    theta=np.where(r>0.000001,np.arctan2(y,x),0.)
+    return r,theta
+
+
+def mode_fields(plasma_field):
+    """the fields whose mode files are needed for plasma_field: (r, theta) components for transverse components"""
+    if plasma_field not in transverse_pair:
+        return [plasma_field]
+    return sorted([plasma_field,transverse_pair[plasma_field]])
+
+
+def mode_weights(plasma_field,theta,mode_max,harm=None):
+    """
+    the field names to read and the weight of each of their mode arrays, so that the cartesian field is the sum of
+    weights * (mode arrays interpolated at r). transverse vector components are rotated from (r, theta) to (x2, x3)
+    :param harm: mode_harmonics(theta,mode_max) if it is already known
+    """
+    if harm is None:
+        harm=mode_harmonics(theta,mode_max)
+    fields=mode_fields(plasma_field)
+    if plasma_field not in transverse_pair:
+        return fields, harm
+    # x2 = y: f_r sin(theta) + f_th cos(theta);  x3 = x: f_r cos(theta) - f_th sin(theta)
+    if plasma_field[1]=='2':
+        return fields, np.concatenate((harm*np.sin(theta),harm*np.cos(theta)))
+    else:
+        return fields, np.concatenate((harm*np.cos(theta),-harm*np.sin(theta)))
+
+
+def spline_stencil(x_data,x_eval,k=3):
+    """
+    stencil of the interpolating spline through x_data evaluated at x_eval: the index of the first of the k+1 nonzero
+    B-spline coefficients at each x_eval, and their weights (shape (len(x_eval), k+1)). points outside x_data take the
+    value at the nearest end (like interp2d did), extrapolating the cubic blows up e.g. in the corners of the box
+    """
+    t=interpolate.make_interp_spline(x_data,np.zeros(len(x_data)),k=k).t
+    x_eval=np.clip(np.ravel(x_eval),x_data[0],x_data[-1])
+    dm=interpolate.BSpline.design_matrix(x_eval,t,k,extrapolate=True).tocsr()
+    # every row has k+1 consecutive nonzeros
+    return dm.indices.reshape(-1,k+1)[:,0],dm.data.reshape(-1,k+1)
+
+
+def spline_coefficients(modes,r_axis,z_axis,k=3):
+    """tensor product spline coefficients of the mode arrays (shape (n_arrays, nr, nz)), returned as (nr, nz, n_arrays)"""
+    cz=interpolate.make_interp_spline(z_axis,np.moveaxis(modes,-1,0),k=k).c
+    return interpolate.make_interp_spline(r_axis,np.moveaxis(cz,-1,0),k=k).c
+
+
+def wrap_h5data(a,meta,plasma_field,axes):
+    """H5Data of the reconstructed field a, with the time stamp and run attributes of the mode file meta"""
+    data_attrs = meta.data_attrs.copy()
+    data_attrs.update({'NAME': plasma_field, 'LONG_NAME': plasma_field})
+    run_attrs = meta.run_attrs.copy()
+    run_attrs.update({'XMAX':np.array([ax.max for ax in axes]), 'XMIN':np.array([ax.min for ax in axes])})
+    return osh5def.H5Data(a, timestamp=meta.timestamp, data_attrs=data_attrs, run_attrs=run_attrs, axes=axes)
+
+
+class Q3DMapper(object):
+    """
+    Mapping from the (r, z) grid of the mode files of a quasi-3d run to a cartesian grid: the spline stencils (indices
+    and weights) along z for every x1 slice and along r for every radius of the transverse plane, and the theta
+    harmonics. They are the same for every field and every time step of a run, so once they are computed converting
+    mode arrays is only gather-and-multiply work. Usage:
+            m = Q3DMapper(r_axis, z_axis, mode_max, x1_min,x1_max,nx1,x2_min,x2_max,nx2,x3_min,x3_max,nx3)
+            m.save('run-map.npz')                       # m = Q3DMapper.load('run-map.npz') in later sessions
+            for fileno in range(100):
+                data_0, modes = read_modes(rundir, 'e1', fileno, mode_max)
+                a = m.map(modes, 'e1')                  # ndarray of shape (nx1, nx2, nx3)
+    """
+    _arrays=('r_axis','z_axis','grid','iz','wz','ir','wr','r_index','theta','harm')
+
+    def __init__(self,r_axis,z_axis,mode_max,x1_min,x1_max,nx1,x2_min,x2_max,nx2,x3_min,x3_max,nx3):
+        """
+        :param r_axis, z_axis: coordinates of the mode arrays, axes[0] and axes[1] of the mode files
+        :param mode_max, x1_min, ..., nx3: see q3d_to_3d
+        """
+        self.r_axis,self.z_axis=np.asarray(r_axis,dtype=float),np.asarray(z_axis,dtype=float)
+        self.mode_max=mode_max
+        self.grid=np.array([x1_min,x1_max,nx1,x2_min,x2_max,nx2,x3_min,x3_max,nx3],dtype=float)
+        self.iz,self.wz=spline_stencil(self.z_axis,sample_points(x1_min,x1_max,nx1))
+        # (r, theta) of the transverse plane, every x1 slice shares the same ones
+        r,theta=polar_coordinates(sample_points(x2_min,x2_max,nx2),sample_points(x3_min,x3_max,nx3))
+        r_eval,r_index=np.unique(r,return_inverse=True)
+        self.ir,self.wr=spline_stencil(self.r_axis,r_eval)
+        self.r_index=r_index.ravel()
+        self.theta=theta.ravel()
+        self.harm=mode_harmonics(self.theta,mode_max)
+        self.__weights={}
+
+    @property
+    def shape(self):
+        return tuple(int(n) for n in self.grid[2::3])
+
+    def axes(self):
+        return cartesian_axes(*[int(g) if i%3==2 else g for i,g in enumerate(self.grid)])
+
+    def save(self,filename):
+        """store the mapping in an .npz file"""
+        np.savez(filename,mode_max=self.mode_max,**{k:getattr(self,k) for k in self._arrays})
+
+    @classmethod
+    def load(cls,filename):
+        m=cls.__new__(cls)
+        with np.load(filename) as f:
+            for k in cls._arrays:
+                setattr(m,k,f[k])
+            m.mode_max=int(f['mode_max'])
+        m.__weights={}
+        return m
+
+    def check(self,r_axis,z_axis,mode_max,grid=None):
+        """raise ValueError if the mapping is not for this mode grid (and cartesian grid)"""
+        if (mode_max!=self.mode_max or not np.array_equal(np.asarray(r_axis,dtype=float),self.r_axis) or
+                not np.array_equal(np.asarray(z_axis,dtype=float),self.z_axis) or
+                (grid is not None and not np.allclose(np.asarray(grid,dtype=float),self.grid))):
+            raise ValueError('Q3DMapper was made for a different mode grid, mode_max or cartesian grid')
+
+    def weights(self,plasma_field):
+        """weights of the mode arrays of plasma_field at every point of the transverse plane, see mode_weights"""
+        kind=plasma_field[1] if plasma_field in transverse_pair else ''
+        if kind not in self.__weights:
+            self.__weights[kind]=mode_weights(plasma_field,self.theta,self.mode_max,harm=self.harm)[1]
+        return self.__weights[kind]
+
+    def coefficients(self,modes):
+        """spline coefficients of the mode arrays (shape (n_arrays, nr, nz)), see map_coefficients"""
+        modes=np.asarray(modes)
+        if modes.shape[-2:]!=(len(self.r_axis),len(self.z_axis)):
+            raise ValueError('Mode arrays of shape '+str(modes.shape[-2:])+' do not match the mapper grid '+
+                             str((len(self.r_axis),len(self.z_axis))))
+        return spline_coefficients(modes,self.r_axis,self.z_axis)
+
+    def map(self,modes,plasma_field,x1_slice=slice(None)):
+        """
+        the cartesian field from its mode arrays
+        :param modes: mode arrays of all the fields in mode_fields(plasma_field), in the order of read_modes
+        :param x1_slice: only compute these x1 slices
+        :return: ndarray of shape (number of x1 slices, nx2, nx3)
+        """
+        return self.map_coefficients(self.coefficients(modes),plasma_field,x1_slice)
+
+    def map_coefficients(self,c,plasma_field,x1_slice=slice(None)):
+        """same as map but from the spline coefficients, so that they are computed only once for many slabs"""
+        iz,wz=self.iz[x1_slice],self.wz[x1_slice]
+        # along z, all the arrays at once: (nr, n1, n_arrays)
+        cz=np.zeros((c.shape[0],len(iz),c.shape[2]))
+        for j in range(wz.shape[1]):
+            cz+=c[:,iz+j]*wz[np.newaxis,:,j,np.newaxis]
+        # along r at the distinct radii, then sum of the modes, one mode array at a time
+        a=np.zeros((len(self.r_index),len(iz)))
+        v=np.empty((len(self.ir),len(iz)))
+        for k,w in enumerate(self.weights(plasma_field)):
+            v[...]=0
+            for i in range(self.wr.shape[1]):
+                v+=self.wr[:,i,np.newaxis]*cz[self.ir+i,:,k]
+            a+=v[self.r_index]*w[:,np.newaxis]
+        return np.ascontiguousarray(a.T).reshape((len(iz),)+self.shape[1:])
+
+
+def q3d_mapper(mapper,meta,mode_max,*grid):
+    """
+    the Q3DMapper for the mode grid of meta (a mode file) and the cartesian grid
+    :param mapper: a Q3DMapper, the name of an .npz file (loaded if it exists, otherwise created and saved there) or None
+    """
+    r_axis,z_axis=meta.axes[0].ax,meta.axes[1].ax
+    if isinstance(mapper,Q3DMapper):
+        m=mapper
+    elif mapper is not None and os.path.isfile(mapper):
+        m=Q3DMapper.load(mapper)
+    else:
+        m=Q3DMapper(r_axis,z_axis,mode_max,*grid)
+        if mapper is not None:
+            m.save(mapper)
+    m.check(r_axis,z_axis,mode_max,grid)
+    return m
+
+
+def q3d_state(rundir,plasma_field,fileno,mode_max,mapper):
+    """
+    read the mode files and compute their spline coefficients, see q3d_slab
+    """
+    modes=[]
+    for fld in mode_fields(plasma_field):
+        data_0,m=read_modes(rundir,fld,fileno,mode_max)
+        modes.extend(m)
+    return {'field':plasma_field, 'mapper':mapper, 'coefficients':mapper.coefficients(modes)}
+
+
+def q3d_slab(state,x1_slice=slice(None)):
+    """the 3d field of the x1 slices x1_slice (shape (number of slices, nx2, nx3)), state is from q3d_state"""
+    return state['mapper'].map_coefficients(state['coefficients'],state['field'],x1_slice)
+
+
+# every worker process reads the mode files once, then computes slabs from them
+_slab_state=None
+
+
+def _init_slab_worker(*args):
+    global _slab_state
+    _slab_state=q3d_state(*args)
+
+
+def _slab_worker(x1_slice):
+    return q3d_slab(_slab_state,x1_slice)
+
+
+def _save_progress(progress_file,done):
+    tmp=progress_file+'.tmp'+str(os.getpid())
+    with open(tmp,'w') as f:
+        json.dump(sorted(done),f)
+    os.replace(tmp,progress_file)
+
+
+def q3d_to_3d(rundir,plasma_field,fileno,mode_max,x1_min,x1_max,nx1,x2_min,x2_max,nx2,x3_min,x3_max,nx3,
+              slab=None,workers=1,resume=False,compression=None,verbose=False,mapper=None):
+    """
+    reconstruct the 3d field from the quasi-3d modes on a cartesian grid and write it to filename_3d(...)
+    :param slab: None computes the whole volume in memory and returns it as H5Data. Otherwise the volume is computed
+                 slab x1 slices at a time and each slab is written into a chunked dataset as soon as it is ready, only
+                 a few slabs are in memory and a lazy H5Data of the output file is returned
+    :param workers: number of processes computing the slabs, each of them reads the mode files once
+    :param resume: continue an interrupted slab-wise run, the slabs already written are skipped. the finished slabs are
+                   tracked in filename_3d(...) + '.progress', which is removed once the file is complete
+    :param compression: compression of the output dataset, e.g. 'gzip', slab-wise only
+    :param verbose: print the progress of each slab
+    :param mapper: Q3DMapper (or the name of its .npz file, created if it does not exist) to reuse for the other
+                   fields and time steps of the run, see Q3DMapper
+    """
+    axes=cartesian_axes(x1_min,x1_max,nx1,x2_min,x2_max,nx2,x3_min,x3_max,nx3)
+    filename_out = filename_3d(rundir,plasma_field,fileno)
+    os.makedirs(os.path.dirname(filename_out),exist_ok=True)
+    meta=osh5io.read_h5(filename_re(rundir,plasma_field,0,fileno),lazy=True)
+    mapper=q3d_mapper(mapper,meta,mode_max,x1_min,x1_max,nx1,x2_min,x2_max,nx2,x3_min,x3_max,nx3)
+
+    if slab is None:
+        state=q3d_state(rundir,plasma_field,fileno,mode_max,mapper)
+        b=wrap_h5data(q3d_slab(state),meta,plasma_field,axes)
+        osh5io.write_h5(b,filename=filename_out)
+        return b
+
+    progress_file=filename_out+'.progress'
+    if resume and os.path.isfile(filename_out) and not os.path.isfile(progress_file):
+        return osh5io.read_h5(filename_out,lazy=True)  # finished already
+    done=set()
+    if resume and os.path.isfile(progress_file):
+        with open(progress_file) as f:
+            done=set(json.load(f))
+    starts=[i for i in range(0,nx1,slab) if i not in done]
+
+    w=osh5io.H5StreamWriter(filename_out,(nx1,nx2,nx3),'float64',dataset_name=plasma_field,frames_per_chunk=slab,
+                            compression=compression,resume=bool(done))
+    _save_progress(progress_file,done)
+    pool=None
+    try:
+        if workers>1:
+            pool=ProcessPoolExecutor(workers,initializer=_init_slab_worker,
+                                     initargs=(rundir,plasma_field,fileno,mode_max,mapper))
+            submit=lambda i: pool.submit(_slab_worker,slice(i,i+slab))
         else:
-            data_re=osh5io.read_h5(filename_re(rundir,plasma_field,i_mode,fileno))
-            data_im=osh5io.read_h5(filename_im(rundir,plasma_field,i_mode,fileno))
-            func_re = interpolate.interp2d(data_re.axes[1].ax,data_re.axes[0].ax,data_re,kind='cubic')
-            func_im = interpolate.interp2d(data_im.axes[1].ax,data_im.axes[0].ax,data_im,kind='cubic')
- 
-        for i1 in range(0,nx1):
-            for i2 in range(0,nx2):
-                for i3 in range(0,nx3):
-                    z = x1_axis[i1]
-                    x = x3_axis[i3]
-                    y = x2_axis[i2]
-                    
-                    r = np.sqrt(x*x+y*y)
-                    
-                    if r > 0.000001:
-                        cos_th = x/r
-                        sin_th = y/r
-                    else:
-                        cos_th = 1
-                        sin_th = 0
-                    # start the recursion relation to evaluate cos(n*theta) and sin(n_theta)  
-                    sin_n=sin_th
-                    cos_n=cos_th
-                    for int_mode in range(2,i_mode+1):
-                        temp_s=sin_n
-                        temp_c=cos_n
-                        cos_n=temp_c*cos_th-temp_s*sin_th
-                        sin_n=temp_s*cos_th+temp_c*sin_th
-                    #
-                    # here we perform the addition of the N-th mode
-                    # to the data in 3D
-                    #
-                    a[i1,i2,i3]=a[i1,i2,i3]+func_re(z,r)*cos_n-func_im(z,r)*sin_n
-                        
- 
-
-    osh5io.write_h5(b,filename=filename_out)
-    
-                
-# ******************************************************************************************************
-# ******************************************************************************************************
-# ******************************************************************************************************
-# ******************************************************************************************************
-
-    
+            state=q3d_state(rundir,plasma_field,fileno,mode_max,mapper)
+            submit=lambda i: q3d_slab(state,slice(i,i+slab))
+        # keep a few slabs in flight so that the memory stays bounded
+        pending,todo=deque(),deque(starts)
+        while todo or pending:
+            while todo and len(pending)<2*workers:
+                i=todo.popleft()
+                pending.append((i,submit(i)))
+            i,a=pending.popleft()
+            w.write_block(i,a.result() if pool else a)
+            w.flush()
+            done.add(i)
+            _save_progress(progress_file,done)
+            if verbose:
+                print('slab '+str(i)+' of '+filename_out+' done, '+str(len(done))+'/'+str(len(range(0,nx1,slab))))
+    except BaseException:
+        w.abort()
+        raise
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
+    w.close(meta=wrap_h5data(np.broadcast_to(np.zeros(()),(nx1,nx2,nx3)),meta,plasma_field,axes))
+    os.remove(progress_file)
+    return osh5io.read_h5(filename_out,lazy=True)
+
+
+# ******************************************************************************************************
+# ******************************************************************************************************
+# planes and lineouts: only the requested points are evaluated. the spline stencils and the theta harmonics of a set of
+# points only depend on the points and on the (r, z) grid of the mode files, they are cached so that other time steps
+# and other fields reuse them
+# ******************************************************************************************************
+# ******************************************************************************************************
+
+weights_cache_size=16
+_weights_cache=OrderedDict()
+
+
+def point_weights(r_axis,z_axis,x1,x2,x3,mode_max):
+    """spline stencils (along r and z) and theta harmonics of the points (x1, x2, x3), cached"""
+    x1,x2,x3=np.broadcast_arrays(*[np.asarray(x,dtype=float) for x in (x1,x2,x3)])
+    h=hashlib.sha1()
+    for x in (r_axis,z_axis,x1,x2,x3):
+        h.update(np.ascontiguousarray(x,dtype=float).tobytes())
+    key=(h.hexdigest(),x1.shape,mode_max)
+    if key in _weights_cache:
+        _weights_cache.move_to_end(key)
+        return _weights_cache[key]
+    r=np.sqrt(x2*x2+x3*x3)
+    theta=np.where(r>0.000001,np.arctan2(x2,x3),0.)
+    wts={'r':spline_stencil(r_axis,r),'z':spline_stencil(z_axis,x1),'theta':theta.ravel(),
+         'harm':mode_harmonics(theta.ravel(),mode_max),'shape':x1.shape}
+    _weights_cache[key]=wts
+    while len(_weights_cache)>weights_cache_size:
+        _weights_cache.popitem(last=False)
+    return wts
+
+
+def q3d_points(rundir,plasma_field,fileno,mode_max,x1,x2,x3):
+    """
+    the 3d field at the points (x1, x2, x3) (arrays of the same shape), x1 = z, x2 = y and x3 = x
+    :return: (ndarray of the field, mode 0 H5Data of plasma_field)
+    """
+    modes=[]
+    for fld in mode_fields(plasma_field):
+        data_0,m=read_modes(rundir,fld,fileno,mode_max)
+        modes.extend(m)
+        if fld==plasma_field:
+            meta=data_0
+    r_axis,z_axis=meta.axes[0].ax,meta.axes[1].ax
+    wts=point_weights(r_axis,z_axis,x1,x2,x3,mode_max)
+    weights=mode_weights(plasma_field,wts['theta'],mode_max,harm=wts['harm'])[1]
+
+    c=spline_coefficients(np.asarray(modes),r_axis,z_axis)
+    (ir,wr),(iz,wz)=wts['r'],wts['z']
+    values=np.zeros((len(ir),c.shape[-1]))
+    for i in range(wr.shape[1]):
+        for j in range(wz.shape[1]):
+            values+=(wr[:,i]*wz[:,j])[:,np.newaxis]*c[ir+i,iz+j]
+    return np.einsum('pa,ap->p',values,weights).reshape(wts['shape']),meta
+
+
+def line_axis(start,edge,n,name):
+    """axis along edge: x1, x2 or x3 if edge is along one of them, otherwise the distance from start"""
+    nonzero=np.flatnonzero(edge)
+    if len(nonzero)==1 and edge[nonzero[0]]>0:
+        d=nonzero[0]
+        return sample_axis(start[d],start[d]+edge[d],n,
+                           attrs={'NAME':'x'+str(d+1), 'LONG_NAME':'x_'+str(d+1), 'UNITS':'c / \\omega_0'})
+    return sample_axis(0.,np.sqrt(np.sum(np.square(edge))),n,
+                       attrs={'NAME':name, 'LONG_NAME':name, 'UNITS':'c / \\omega_0'})
+
+
+def q3d_plane(rundir,plasma_field,fileno,mode_max,origin,u,v,nu,nv):
+    """
+    the 3d field on the plane origin + a * u + b * v, a and b from 0 to 1 (both ends included)
+    e.g. the x2-x3 plane at x1 = z0: origin=(z0, x2_min, x3_min), u=(0, x2_max - x2_min, 0), v=(0, 0, x3_max - x3_min)
+    :param origin, u, v: (x1, x2, x3) coordinates of the corner and of the two edges of the plane
+    :param nu, nv: number of points along u and v
+    :return: H5Data of shape (nu, nv)
+    """
+    origin,u,v=[np.asarray(p,dtype=float) for p in (origin,u,v)]
+    a,b=np.meshgrid(sample_points(0.,1.,nu),sample_points(0.,1.,nv),indexing='ij')
+    x1,x2,x3=[origin[d]+a*u[d]+b*v[d] for d in range(3)]
+    data,meta=q3d_points(rundir,plasma_field,fileno,mode_max,x1,x2,x3)
+    return wrap_h5data(data,meta,plasma_field,[line_axis(origin,u,nu,'s1'),line_axis(origin,v,nv,'s2')])
+
+
+def q3d_lineout(rundir,plasma_field,fileno,mode_max,start,end,n):
+    """
+    the 3d field along the line from start to end (both included)
+    :param start, end: (x1, x2, x3) coordinates of the ends of the line
+    :param n: number of points
+    :return: 1D H5Data
+    """
+    start,end=np.asarray(start,dtype=float),np.asarray(end,dtype=float)
+    a=sample_points(0.,1.,n)
+    x1,x2,x3=[start[d]+a*(end[d]-start[d]) for d in range(3)]
+    data,meta=q3d_points(rundir,plasma_field,fileno,mode_max,x1,x2,x3)
+    return wrap_h5data(data,meta,plasma_field,[line_axis(start,end-start,n,'s')])
+
+
+def _test_spline_stencil_outside():
+    """points outside the (r, z) grid, e.g. the corners of the box at sqrt(2) * rmax, take the values at the edge"""
+    r_axis,z_axis=0.25+0.5*np.arange(40),0.1*np.arange(30)
+    field=np.exp(-(r_axis[:,np.newaxis]/5.)**2)*np.cos(z_axis)[np.newaxis,:]
+    c=spline_coefficients(field[np.newaxis],r_axis,z_axis)[...,0]
+
+    def evaluate(r,z):
+        (ir,wr),(iz,wz)=spline_stencil(r_axis,r),spline_stencil(z_axis,z)
+        return sum(wr[:,i]*wz[:,j]*c[ir+i,iz+j] for i in range(wr.shape[1]) for j in range(wz.shape[1]))
+
+    r=np.array([r_axis[-1]+0.1,np.sqrt(2)*r_axis[-1],0.,r_axis[-1]])
+    z=np.array([z_axis[5],z_axis[-1]+1.,z_axis[0]-1.,z_axis[5]])
+    assert np.allclose(evaluate(r,z),[field[-1,5],field[-1,-1],field[0,0],field[-1,5]])
+
+
+# ******************************************************************************************************
+# ******************************************************************************************************
+# ******************************************************************************************************
+# ******************************************************************************************************